@@ -24,21 +24,34 @@ yyyy-mm-dd ... ...
 
 import socket
 import json
+import asyncio
+import itertools
+import threading
+import weakref
 
 TCP_PORT = 9090
-BUFFER_SIZE = 100
+BUFFER_SIZE = 65536
 
-def connect(IP):
+# The module functions below (connect ... print_ERROR) are the original attocube
+# wrappers, kept as frozen legacy code for existing scripts: one blocking request
+# per call with id 3, and errors are printed, not raised. They are not extended or
+# converted to METHODS. New code should use AMCClient, whose methods are generated
+# from METHODS, share one result check (AMCMethod.parse, raising AMCError) and
+# support batched and concurrent requests.
+
+def connect(IP, port=TCP_PORT):
     """
         Initializes and connects the selected AMC device.
     Parameters
     ----------
     IP : String
         Address of the device to connect
+    port : Int32
+        TCP port of the device
     """
     tcp = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
     tcp.settimeout(3)
-    tcp.connect((IP, TCP_PORT))
+    tcp.connect((IP, port))
     return tcp
 
 def close(tcp):
@@ -1735,18 +1748,13 @@ def getJSONresponse(tcp):
         TCP/IP connection ID
     Returns
     -------
-    response : Index Table
-       Table of Values
+    response : bytearray
+       JSON encoded response without CRLF
     """
-    response = ''
-    remainder = ''
-    while '\r\n' not in response: # receive data as long as there is no CRLF in data
-        response += tcp.recv(100).decode("utf-8") # concatenate new data to already received data
-    i = response.rfind("\r\n") # find position index of CRLF
-    response, remainder = response[:i+2], response[i+2:] # split response at CRLF
-    if remainder != '': print('Warning, there is some ignored data after CRLF: ' + str(remainder))
-    #print('response: ' + str(response)) # show data before CRLF for bedugging
-    return response #, remainder
+    reader = _readers.get(tcp)
+    if reader is None:
+        reader = _readers[tcp] = FrameReader(tcp)
+    return reader.readline() # data after CRLF is kept for the next response
 
 def print_ERROR(tcp,errorNumber):
     """
@@ -1756,4 +1764,576 @@ def print_ERROR(tcp,errorNumber):
     errorNumber : int32
     """
     errorNumber = str(errorNumber)
-    print("Error! " + str(errorNumberToString(tcp,0, errorNumber)))
\ No newline at end of file
+    print("Error! " + str(errorNumberToString(tcp,0, errorNumber)))
+
+class FrameReader(object):
+    """
+        Buffered reader of the CRLF terminated replies of one connection. Data is
+        received in large chunks into a reusable buffer, and the bytes following a
+        CRLF are kept for the next reply instead of being dropped.
+    Parameters
+    ----------
+    tcp : Int32
+        TCP/IP connection ID
+    """
+
+    def __init__(self, tcp, size=BUFFER_SIZE):
+        self.tcp = tcp
+        self._chunk = memoryview(bytearray(size))
+        self._buffer = bytearray()
+        self._scanned = 0 # the buffer before this index contains no CRLF
+
+    def readline(self):
+        """
+            Returns the next reply without its CRLF.
+        Returns
+        -------
+        response : bytearray
+            JSON encoded reply, can be parsed by json.loads directly
+        """
+        while True:
+            i = self._buffer.find(b'\r\n', self._scanned)
+            if i >= 0:
+                line = self._buffer[:i]
+                del self._buffer[:i+2]
+                self._scanned = 0
+                return line
+            self._scanned = max(len(self._buffer) - 1, 0)
+            n = self.tcp.recv_into(self._chunk)
+            if not n:
+                raise ConnectionError('Connection closed by the AMC device')
+            self._buffer += self._chunk[:n]
+
+# readers of the sockets used by the module functions
+_readers = weakref.WeakKeyDictionary()
+
+class AMCError(Exception):
+    """
+        Error reply of the AMC device to a JSON-RPC request.
+    """
+
+    def __init__(self, errorNumber, method=None):
+        if method is None:
+            message = 'Error {}'.format(errorNumber)
+        else:
+            message = 'Error {} in AMC method {}'.format(errorNumber, method)
+        super(AMCError, self).__init__(message)
+        self.errorNumber = errorNumber
+
+# JSON-RPC methods of the AMC device, one row per method:
+# (name, JSON-RPC method, parameter types or constant values, result shape)
+# result shapes: None - only the errorNumber, 'value' - errorNumber and one value,
+# 'values' - errorNumber and several values, 'plain' - values without errorNumber
+METHODS = (
+    ('getLockStatus', 'getLockStatus', (), 'plain'),
+    ('lock', 'lock', (str,), None),
+    ('grantAccess', 'grantAccess', (str,), None),
+    ('unlock', 'unlock', (), None),
+    ('errorNumberToString', 'com.attocube.system.errorNumberToString', (int, int), 'plain'),
+    ('setOutput', 'com.attocube.amc.control.setControlOutput', (int, bool), None),
+    ('getOutput', 'com.attocube.amc.control.getControlOutput', (int,), 'value'),
+    ('setAmplitude', 'com.attocube.amc.control.setControlAmplitude', (int, int), None),
+    ('getAmplitude', 'com.attocube.amc.control.getControlAmplitude', (int,), 'value'),
+    ('setFrequency', 'com.attocube.amc.control.setControlFrequency', (int, int), None),
+    ('getFrequency', 'com.attocube.amc.control.getControlFrequency', (int,), 'value'),
+    ('setActorSelection', 'com.attocube.amc.control.setActorParametersByname', (int, str), None),
+    ('getActorname', 'com.attocube.amc.control.getActorParametersActorname', (int,), 'value'),
+    ('getActorType', 'com.attocube.amc.control.getActorType', (int,), 'value'),
+    ('setReset', 'com.attocube.amc.control.setReset', (int,), None),
+    ('setMove', 'com.attocube.amc.control.setControlMove', (int, bool), None),
+    ('getMove', 'com.attocube.amc.control.getControlMove', (int,), 'value'),
+    ('setNSteps', 'com.attocube.amc.move.setNSteps', (int, bool, int), None),
+    ('setSingleStep', 'com.attocube.amc.move.setNSteps', (int, bool, 1), None),
+    ('getNSteps', 'com.attocube.amc.move.getNSteps', (int,), 'value'),
+    ('setContinuousFwd', 'com.attocube.amc.move.setControlContinousFwd', (int, bool), None),
+    ('getContinuousFwd', 'com.attocube.amc.move.getControlContinousFwd', (int,), 'value'),
+    ('setContinuousBkwd', 'com.attocube.amc.move.setControlContinousBkwd', (int, bool), None),
+    ('getContinuousBkwd', 'com.attocube.amc.move.getControlContinousBkwd', (int,), 'value'),
+    ('setTargetPosition', 'com.attocube.amc.move.setControlTargetPosition', (int, int), None),
+    ('getTargetPosition', 'com.attocube.amc.move.getControlTargetPosition', (int,), 'value'),
+    ('getStatusReference', 'com.attocube.amc.status.getStatusReference', (int,), 'value'),
+    ('getStatusMoving', 'com.attocube.amc.status.getStatusMoving', (int,), 'value'),
+    ('getStatusConnected', 'com.attocube.amc.status.getStatusConnected', (int,), 'value'),
+    ('getReferencePosition', 'com.attocube.amc.control.getReferencePosition', (int,), 'value'),
+    ('getPosition', 'com.attocube.amc.move.getPosition', (int,), 'value'),
+    ('setReferenceAutoUpdate', 'com.attocube.amc.control.setControlReferenceAutoUpdate', (int, bool), None),
+    ('getReferenceAutoUpdate', 'com.attocube.amc.control.getControlReferenceAutoUpdate', (int,), 'value'),
+    ('setAutoReset', 'com.attocube.amc.control.setControlAutoReset', (int, bool), None),
+    ('getAutoReset', 'com.attocube.amc.control.getControlAutoReset', (int,), 'value'),
+    ('setTargetRange', 'com.attocube.amc.control.setControlTargetRange', (int, int), None),
+    ('getTargetRange', 'com.attocube.amc.control.getControlTargetRange', (int,), 'value'),
+    ('getStatusTargetRange', 'com.attocube.amc.status.getStatusTargetRange', (int,), 'value'),
+    ('getFirmwareVersion', 'com.attocube.system.getFirmwareVersion', (), 'plain'),
+    ('getFpgaVersion', 'com.attocube.amc.description.getFpgaVersion', (), 'plain'),
+    ('rebootSystem', 'com.attocube.system.rebootSystem', (), None),
+    ('factoryReset', 'com.attocube.system.factoryReset', (), None),
+    ('getMAC', 'com.attocube.system.getMacAddress', (), 'plain'),
+    ('getIPAddress', 'com.attocube.system.network.getIpAddress', (), 'plain'),
+    ('getDeviceType', 'com.attocube.amc.description.getDeviceType', (), 'plain'),
+    ('getSN', 'com.attocube.system.getSerialNumber', (), 'plain'),
+    ('getDevicename', 'com.attocube.system.getDevicename', (), 'plain'),
+    ('setDevicename', 'com.attocube.system.setDevicename', (str,), None),
+    ('getStatusEotFwd', 'com.attocube.amc.status.getStatusEotFwd', (int,), 'value'),
+    ('getStatusEotBkwd', 'com.attocube.amc.status.getStatusEotBkwd', (int,), 'value'),
+    ('setEotOutputDeactive', 'com.attocube.amc.move.setControlEotOutputDeactive', (int, bool), None),
+    ('getEotOutputDeactive', 'com.attocube.amc.move.getControlEotOutputDeactive', (int,), 'value'),
+    ('setFixOutputVoltage', 'com.attocube.amc.control.setControlFixOutputVoltage', (int, int), None),
+    ('getFixOutputVoltage', 'com.attocube.amc.control.getControlFixOutputVoltage', (int,), 'value'),
+    ('getPositionersList', 'com.attocube.amc.description.getPositionersList', (), 'value'),
+    ('setAQuadBInResolution', 'com.attocube.amc.rtin.setControlAQuadBInResolution', (int, int), None),
+    ('getAQuadBInResolution', 'com.attocube.amc.rtin.getControlAQuadBInResolution', (int, 0), 'value'),
+    ('setAQuadBOut', 'com.attocube.amc.rtout.setControlAQuadBOut', (int, bool), None),
+    ('getAQuadBOut', 'com.attocube.amc.rtout.getControlAQuadBOut', (int, 0), 'value'),
+    ('setAQuadBOutResolution', 'com.attocube.amc.rtout.setControlAQuadBOutResolution', (int, int), None),
+    ('getAQuadBOutResolution', 'com.attocube.amc.rtout.getControlAQuadBOutResolution', (int, 0), 'value'),
+    ('setAQuadBOutclock', 'com.attocube.amc.rtout.setControlAQuadBOutclock', (int, int), None),
+    ('getAQuadBOutclock', 'com.attocube.amc.rtout.getControlAQuadBOutclock', (int, 0), 'value'),
+    ('setRtOutsignalMode', 'com.attocube.amc.rtout.setRtOutsignalMode', (int,), None),
+    ('getRtOutsignalMode', 'com.attocube.amc.rtout.getRtOutsignalMode', (0,), 'value'),
+    ('applyRtOut', 'com.attocube.amc.rtout.apply', (int,), None),
+    ('setRealTimeInMode', 'com.attocube.amc.rtin.setRealTimeInMode', (int, int), None),
+    ('getRealTimeInMode', 'com.attocube.amc.rtin.getRealTimeInMode', (int, 0), 'value'),
+    ('setRealTimeInFeedbackLoopMode', 'com.attocube.amc.rtin.setRealTimeInFeedbackLoopMode', (int, int), None),
+    ('getRealTimeInFeedbackLoopMode', 'com.attocube.amc.rtin.getRealTimeInFeedbackLoopMode', (int, 0), 'value'),
+    ('setRealtimeInputChangePerPulse', 'com.attocube.amc.rtin.setRealTimeInChangePerPulse', (int, int), None),
+    ('getRealtimeInputChangePerPulse', 'com.attocube.amc.rtin.getRealTimeInChangePerPulse', (int, 0), 'value'),
+    ('setRealtimeInputStepsPerPulse', 'com.attocube.amc.rtin.setRealTimeInStepsPerPulse', (int, int), None),
+    ('getRealtimeInputStepsPerPulse', 'com.attocube.amc.rtin.getRealTimeInStepsPerPulse', (int, 0), 'value'),
+    ('setRealtimeInputMove', 'com.attocube.amc.rtin.setControlMoveGPIO', (int, bool), None),
+    ('getRealtimeInputMove', 'com.attocube.amc.rtin.getControlMoveGPIO', (int, 0), 'value'),
+    ('applyRealTimeIn', 'com.attocube.amc.rtin.apply', (int,), None),
+)
+
+def _encodeInt(value):
+    return b'%d' % value
+
+def _encodeBool(value):
+    return b'true' if value else b'false'
+
+def _encodeStr(value):
+    return json.dumps(str(value)).encode('utf-8')
+
+_ENCODERS = {int: _encodeInt, bool: _encodeBool, str: _encodeStr}
+
+class AMCMethod(object):
+    """
+        Precompiled request of one AMC method. The constant parts of the message are
+        encoded once, so building a request is a single bytes join.
+    Parameters
+    ----------
+    name : String
+        local name of the method
+    method : String
+        Name of the JSON-RPC method
+    params : Tuple
+        parameter types (int, bool, str) or constant parameter values
+    shape : String
+        shape of the result, see METHODS
+    """
+    __slots__ = ('name', 'method', 'shape', '_parts', '_encoders')
+
+    def __init__(self, name, method, params, shape):
+        self.name = name
+        self.method = method
+        self.shape = shape
+        parts = []
+        encoders = []
+        text = '{"jsonrpc":"2.0","method":' + json.dumps(method)
+        if params:
+            text += ',"params":['
+            for i, param in enumerate(params):
+                if i:
+                    text += ','
+                if isinstance(param, type):
+                    parts.append(text.encode('utf-8'))
+                    encoders.append(_ENCODERS[param])
+                    text = ''
+                else:
+                    text += json.dumps(param)
+            text += ']'
+        text += ',"id":'
+        parts.append(text.encode('utf-8'))
+        self._parts = tuple(parts)
+        self._encoders = tuple(encoders)
+
+    def encode(self, params, id):
+        """
+            Builds the request message.
+        Parameters
+        ----------
+        params : Tuple
+            values of the variable parameters
+        id : Int32
+            ID of the request
+        Returns
+        -------
+        message : bytes
+            JSON encoded request
+        """
+        if len(params) != len(self._encoders):
+            raise TypeError('{}() takes {} parameters ({} given)'.format(
+                self.name, len(self._encoders), len(params)))
+        parts = self._parts
+        data = [parts[0]]
+        for encode, value, part in zip(self._encoders, params, parts[1:]):
+            data.append(encode(value))
+            data.append(part)
+        data.append(b'%d}' % id)
+        return b''.join(data)
+
+    def parse(self, result):
+        """
+            Checks the errorNumber of the result and returns its values.
+        Parameters
+        ----------
+        result : List
+            result of the JSON-RPC response
+        Returns
+        -------
+        values : None, value or Tuple according to the shape of the method
+        """
+        if self.shape == 'plain':
+            return result[0] if len(result) == 1 else tuple(result)
+        errorNumber = result[0]
+        if errorNumber != 0 and errorNumber != 'null':
+            raise AMCError(errorNumber, self.name)
+        if self.shape == 'value':
+            return result[1]
+        elif self.shape == 'values':
+            return tuple(result[1:])
+
+_methods = {row[0]: AMCMethod(*row) for row in METHODS}
+
+def _encodeRequest(method, params, id):
+    encoder = _methods.get(method)
+    if encoder is not None:
+        return encoder.encode(tuple(params or ()), id)
+    # the order of the message parts is mandatory for the AMC device
+    message = {"jsonrpc": "2.0", "method": method}
+    if params is not None:
+        message["params"] = list(params)
+    message["id"] = id
+    return json.dumps(message).encode('utf-8')
+
+class AMCClient(object):
+    """
+        Persistent JSON-RPC client of the selected AMC device. Every request gets a
+        unique ID, so several requests can be in flight on the same socket and the
+        replies are matched back to their callers by ID.
+
+        Every method of METHODS is also available as a method of the client, e.g.
+        client.getPosition(axis), which returns the values of the result and raises
+        AMCError if the device reports an error.
+    Parameters
+    ----------
+    IP : String
+        Address of the device to connect
+    port : Int32
+        TCP port of the device
+    """
+
+    def __init__(self, IP, port=TCP_PORT):
+        self.tcp = connect(IP, port)
+        self._ids = itertools.count(1)
+        self._sendlock = threading.Lock()
+        self._recvlock = threading.Lock()
+        self._responses = {}
+        self._abandoned = set()
+        self._reader = FrameReader(self.tcp)
+
+    def request(self, method, params=None):
+        """
+            Sends a request without waiting for the reply.
+        Parameters
+        ----------
+        method : String
+            name of a method in METHODS or of a JSON-RPC method
+        params : List
+            Parameters of the method
+        Returns
+        -------
+        id : Int32
+            ID of the request, used to collect the reply with response()
+        """
+        id = next(self._ids)
+        data = _encodeRequest(method, params, id)
+        with self._sendlock:
+            self.tcp.sendall(data)
+        return id
+
+    def requestBatch(self, calls):
+        """
+            Sends several requests as one JSON-RPC batch in a single write, without
+            waiting for the replies.
+        Parameters
+        ----------
+        calls : List
+            sequence of (method, params) pairs, params may be None
+        Returns
+        -------
+        ids : List
+            IDs of the requests in the order of calls
+        """
+        ids = []
+        data = []
+        for method, params in calls:
+            id = next(self._ids)
+            ids.append(id)
+            data.append(_encodeRequest(method, params, id))
+        data = b'[' + b','.join(data) + b']'
+        with self._sendlock:
+            self.tcp.sendall(data)
+        return ids
+
+    def response(self, id):
+        """
+            Waits for the reply of the request with the given ID. Replies of other
+            requests received meanwhile are kept for their callers.
+        Parameters
+        ----------
+        id : Int32
+            ID returned by request()
+        Returns
+        -------
+        response : Dict
+            parsed JSON response
+        """
+        with self._recvlock:
+            try:
+                while id not in self._responses:
+                    response = json.loads(self._reader.readline())
+                    if isinstance(response, list): # reply of a batch request
+                        for item in response:
+                            self._store(item)
+                    else:
+                        self._store(response)
+            except BaseException: # timeout, KeyboardInterrupt...: nobody will collect the reply
+                self._abandon([id])
+                raise
+            return self._responses.pop(id)
+
+    def _store(self, response):
+        id = response.get('id')
+        if id in self._abandoned:
+            self._abandoned.discard(id)
+        else:
+            self._responses[id] = response
+
+    def _abandon(self, ids): # called with _recvlock held
+        for id in ids:
+            if self._responses.pop(id, None) is None:
+                self._abandoned.add(id)
+
+    def result(self, id):
+        """
+            Waits for the reply of the request with the given ID and returns its result.
+        Parameters
+        ----------
+        id : Int32
+            ID returned by request()
+        Returns
+        -------
+        result : List
+            result of the method, the first element is the errorNumber
+        """
+        return self._result(self.response(id))
+
+    @staticmethod
+    def _result(response):
+        if 'error' in response:
+            raise AMCError(response['error'])
+        return response['result']
+
+    @staticmethod
+    def _parse(method, result, check):
+        encoder = _methods.get(method)
+        if check and encoder is not None:
+            return encoder.parse(result)
+        return result
+
+    def call(self, method, params=None, check=True):
+        """
+            Sends a request and waits for its result.
+        Parameters
+        ----------
+        method : String
+            name of a method in METHODS or of a JSON-RPC method
+        params : List
+            Parameters of the method
+        check : Bln
+            True: the result of a method in METHODS is checked and shaped
+            False: the result is returned as it is
+        Returns
+        -------
+        result : values of the result, or the result List of the JSON-RPC method
+        """
+        return self._parse(method, self.result(self.request(method, params)), check)
+
+    def batch(self, calls, check=True):
+        """
+            Sends several requests as one JSON-RPC batch and waits for all results.
+        Parameters
+        ----------
+        calls : List
+            sequence of (method, params) pairs, params may be None
+        check : Bln
+            True: the results of methods in METHODS are checked and shaped
+            False: the results are returned as they are
+        Returns
+        -------
+        results : List
+            results of the methods in the order of calls
+        """
+        ids = self.requestBatch(calls)
+        responses = []
+        try:
+            for id in ids:
+                responses.append(self.response(id))
+        except BaseException:
+            # the failed request is abandoned by response(), the rest are abandoned here
+            with self._recvlock:
+                self._abandon(ids[len(responses) + 1:])
+            raise
+        results = [self._result(response) for response in responses]
+        return [self._parse(method, result, check) for (method, _), result in zip(calls, results)]
+
+    def close(self):
+        """
+            Closes the connection to the device.
+        """
+        self.tcp.close()
+
+def _clientMethod(encoder):
+    def method(self, *params):
+        id = next(self._ids)
+        data = encoder.encode(params, id)
+        with self._sendlock:
+            self.tcp.sendall(data)
+        return encoder.parse(self.result(id))
+    method.__name__ = encoder.name
+    method.__doc__ = 'Calls {} and returns the values of its result.'.format(encoder.method)
+    return method
+
+for _encoder in _methods.values():
+    setattr(AMCClient, _encoder.name, _clientMethod(_encoder))
+
+
+class AsyncAMCClient(object):
+    """
+        asyncio version of AMCClient. Requests of many coroutines share one stream and
+        a background task dispatches the replies to them by ID, so several devices and
+        axes can be driven concurrently from one event loop. Use AsyncAMCClient.open()
+        to connect.
+
+        Every method of METHODS is also available as a coroutine of the client, e.g.
+        await client.getPosition(axis).
+    """
+
+    def __init__(self, reader, writer, timeout=3):
+        self.timeout = timeout
+        self._ids = itertools.count(1)
+        self._reader = reader
+        self._writer = writer
+        self._futures = {}
+        self._error = None # set when the reader task dies, new requests fail with it
+        self._readtask = asyncio.ensure_future(self._readloop())
+
+    @classmethod
+    async def open(cls, IP, timeout=3, port=TCP_PORT):
+        """
+            Initializes and connects the selected AMC device.
+        Parameters
+        ----------
+        IP : String
+            Address of the device to connect
+        timeout : float
+            seconds to wait for the connection and for each reply
+        port : Int32
+            TCP port of the device
+        """
+        reader, writer = await asyncio.wait_for(asyncio.open_connection(IP, port), timeout)
+        return cls(reader, writer, timeout)
+
+    async def _readloop(self):
+        try:
+            while True:
+                line = await self._reader.readuntil(b'\r\n')
+                response = json.loads(line[:-2])
+                for item in (response if isinstance(response, list) else [response]):
+                    future = self._futures.pop(item.get('id'), None)
+                    if future is not None and not future.done():
+                        future.set_result(item)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            error = self._error = ConnectionError('Connection to the AMC device lost: {}'.format(e))
+            for future in self._futures.values():
+                if not future.done():
+                    future.set_exception(error)
+            self._futures.clear()
+
+    def _send(self, data, ids):
+        if self._error is not None:
+            raise self._error
+        loop = asyncio.get_event_loop()
+        futures = []
+        for id in ids:
+            future = self._futures[id] = loop.create_future()
+            futures.append(future)
+        self._writer.write(data)
+        return futures
+
+    async def _response(self, id, future):
+        try:
+            return await asyncio.wait_for(future, self.timeout)
+        finally:
+            self._futures.pop(id, None)
+
+    async def call(self, method, params=None, check=True):
+        """
+            Sends a request and waits for its result, see AMCClient.call.
+        """
+        id = next(self._ids)
+        future, = self._send(_encodeRequest(method, params, id), [id])
+        await self._writer.drain()
+        result = AMCClient._result(await self._response(id, future))
+        return AMCClient._parse(method, result, check)
+
+    async def batch(self, calls, check=True):
+        """
+            Sends several requests as one JSON-RPC batch and waits for all results,
+            see AMCClient.batch.
+        """
+        ids = []
+        data = []
+        for method, params in calls:
+            id = next(self._ids)
+            ids.append(id)
+            data.append(_encodeRequest(method, params, id))
+        futures = self._send(b'[' + b','.join(data) + b']', ids)
+        await self._writer.drain()
+        responses = [await self._response(id, future) for id, future in zip(ids, futures)]
+        results = [AMCClient._result(response) for response in responses]
+        return [AMCClient._parse(method, result, check) for (method, _), result in zip(calls, results)]
+
+    async def close(self):
+        """
+            Closes the connection to the device.
+        """
+        self._readtask.cancel()
+        self._writer.close()
+        if hasattr(self._writer, 'wait_closed'):
+            await self._writer.wait_closed()
+
+def _asyncClientMethod(encoder):
+    async def method(self, *params):
+        id = next(self._ids)
+        future, = self._send(encoder.encode(params, id), [id])
+        await self._writer.drain()
+        return encoder.parse(AMCClient._result(await self._response(id, future)))
+    method.__name__ = encoder.name
+    method.__doc__ = 'Calls {} and returns the values of its result.'.format(encoder.method)
+    return method
+
+for _encoder in _methods.values():
+    setattr(AsyncAMCClient, _encoder.name, _asyncClientMethod(_encoder))
@@ -0,0 +1,481 @@
+# -*- coding: utf-8 -*-
+"""
+AMC100模拟器，以TCP JSON-RPC的方式实现驱动中使用的com.attocube.amc.*方法，
+用于在没有实际设备的情况下测试以及评估驱动的性能。
+
+运行方式：
+    python -m fcre._extern.AMCSimulator --port 9090 --latency 0.001
+    python -m fcre._extern.AMCSimulator --benchmark
+"""
+
+__all__ = ['SimAxis', 'AMCSimulator', 'benchmark']
+
+import argparse
+import json
+import queue
+import socketserver
+import threading
+import time
+
+from fcre._extern import AMC
+
+# 错误码
+ERR_AXIS = 2  # 轴不存在
+ERR_PARAM = 3  # 参数错误
+
+_ERROR_STRINGS = {
+    0: 'No error',
+    ERR_AXIS: 'Axis out of range',
+    ERR_PARAM: 'Invalid parameter',
+}
+
+
+class SimAxis(object):
+    """
+    模拟单个轴的运动，所有状态都在被访问时根据经过的时间更新，不需要单独的线程。
+
+    proprety:
+        position-当前位置，单位nm
+        target-目标位置，单位nm
+        targetRange-目标范围，单位nm
+        limits-行程的上下限，单位nm，到达后产生EOT
+        stepsize-幅值为45V时每一步的步长，单位nm，步长与幅值成正比
+        amplitude-驱动幅值，单位mV
+        frequency-驱动频率，单位mHz
+        output-输出继电器状态
+        move-是否向目标位置移动
+        continuousFwd/continuousBkwd-连续移动状态
+        eotOutputDeactive-EOT时是否停止驱动
+        eotFwd/eotBkwd-EOT状态
+        rtin-实时输入(GPIO/AQuadB)的配置
+
+    method:
+        __init__-初始化
+        velocity-当前驱动参数下的速度，单位nm/s
+        update-按照经过的时间更新位置与状态
+        statusMoving-移动状态，0: idle, 1: moving, 2: pending
+        pulse-实时输入脉冲，按照rtin的配置移动
+    """
+
+    def __init__(self, position=2.5e6, limits=(0.0, 5e6), stepsize=50.0, targetRange=100):
+        self.position = float(position)
+        self.target = float(position)
+        self.targetRange = targetRange
+        self.limits = tuple(limits)
+        self.stepsize = stepsize
+        self.amplitude = 45000
+        self.frequency = 1000000
+        self.output = False
+        self.move = False
+        self.continuousFwd = False
+        self.continuousBkwd = False
+        self.eotOutputDeactive = False
+        self.eotFwd = False
+        self.eotBkwd = False
+        self.rtin = {'mode': 15, 'loop': 0, 'stepsPerPulse': 1, 'changePerPulse': 0, 'move': False}
+        self._lastUpdate = time.time()
+
+    def velocity(self):
+        return self.stepsize * self.amplitude / 45000.0 * self.frequency / 1000.0
+
+    def _direction(self):
+        if not self.output:
+            return 0
+        if self.continuousFwd:
+            return 1
+        if self.continuousBkwd:
+            return -1
+        if self.move and abs(self.target - self.position) > self.targetRange:
+            return 1 if self.target > self.position else -1
+        return 0
+
+    def update(self, now=None):
+        if now is None:
+            now = time.time()
+        dt = now - self._lastUpdate
+        self._lastUpdate = now
+        direction = self._direction()
+        if direction == 0 or dt <= 0:
+            return
+        if (direction > 0 and self.eotFwd) or (direction < 0 and self.eotBkwd):
+            return
+        step = self.velocity() * dt
+        if not (self.continuousFwd or self.continuousBkwd):
+            step = min(step, abs(self.target - self.position))
+        self.position += direction * step
+        if direction > 0:
+            self.eotBkwd = False
+        else:
+            self.eotFwd = False
+        if self.position >= self.limits[1]:
+            self.position = self.limits[1]
+            self.eotFwd = True
+        elif self.position <= self.limits[0]:
+            self.position = self.limits[0]
+            self.eotBkwd = True
+        if (self.eotFwd or self.eotBkwd) and self.eotOutputDeactive:
+            self.continuousFwd = self.continuousBkwd = False
+
+    def statusMoving(self):
+        if self._direction() != 0:
+            return 1
+        if self.move and self.output:
+            return 2
+        return 0
+
+    def pulse(self, n=1):
+        if not (self.output and self.rtin['move'] and self.rtin['mode'] != 15):
+            return
+        if self.rtin['loop']:
+            change = self.rtin['changePerPulse'] * n
+        else:
+            change = self.rtin['stepsPerPulse'] * self.stepsize * self.amplitude / 45000.0 * n
+        self.position = min(max(self.position + change, self.limits[0]), self.limits[1])
+        self.target = self.position
+
+
+class _Handler(socketserver.BaseRequestHandler):
+
+    def handle(self):
+        sim = self.server.simulator
+        replies = queue.Queue()
+        sender = threading.Thread(target=self._send, args=(replies, sim))
+        sender.daemon = True
+        sender.start()
+        decoder = json.JSONDecoder()
+        buffer = ''
+        try:
+            while True:
+                data = self.request.recv(65536)
+                if not data:
+                    break
+                arrival = time.time()
+                buffer += data.decode('utf-8')
+                while True:
+                    buffer = buffer.lstrip()
+                    if not buffer:
+                        break
+                    try:
+                        message, end = decoder.raw_decode(buffer)
+                    except ValueError:
+                        break  # 等待剩余的数据
+                    buffer = buffer[end:]
+                    if isinstance(message, list):
+                        reply = [sim.dispatch(m) for m in message]
+                    else:
+                        reply = sim.dispatch(message)
+                    replies.put((arrival + sim.latency, json.dumps(reply).encode('utf-8') + b'\r\n'))
+        except OSError:
+            pass
+        finally:
+            replies.put(None)
+
+    def _send(self, replies, sim):
+        while True:
+            item = replies.get()
+            if item is None:
+                return
+            due, data = item
+            delay = due - time.time()
+            if delay > 0:
+                time.sleep(delay)
+            try:
+                self.request.sendall(data)
+            except OSError:
+                return
+
+
+class _Server(socketserver.ThreadingTCPServer):
+    allow_reuse_address = True
+    daemon_threads = True
+
+
+class AMCSimulator(object):
+    """
+    AMC100的TCP JSON-RPC模拟器，支持批处理请求，可设置网络延迟。
+
+    proprety:
+        axes-SimAxis的列表
+        latency-每次回复的网络延迟，单位s
+        serialNumber-设备序列号
+        host/port-监听的地址
+        _lock-锁，保证多线程安全
+
+    method:
+        __init__-初始化
+        start-在后台线程中运行服务
+        stop-停止服务
+        dispatch-处理单个JSON-RPC请求
+        pulse-模拟实时输入的外部脉冲
+        pulseTrain-以固定频率产生外部脉冲，代替外部的触发源
+    """
+
+    def __init__(self, host='127.0.0.1', port=AMC.TCP_PORT, numaxes=3, latency=0.0,
+                 serialNumber='SIM-AMC100', **axiskwargs):
+        self.host = host
+        self.port = port
+        self.latency = latency
+        self.serialNumber = serialNumber
+        self.devicename = 'AMC100 simulator'
+        self.axes = [SimAxis(**axiskwargs) for _ in range(numaxes)]
+        self._lock = threading.RLock()
+        self._server = None
+        self._thread = None
+        self._handlers = self._buildHandlers()
+
+    def start(self):
+        self._server = _Server((self.host, self.port), _Handler)
+        self._server.simulator = self
+        self.port = self._server.server_address[1]
+        self._thread = threading.Thread(target=self._server.serve_forever)
+        self._thread.daemon = True
+        self._thread.start()
+        return self
+
+    def stop(self):
+        if self._server:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *args):
+        self.stop()
+
+    def pulse(self, axis, n=1):
+        with self._lock:
+            self.axes[axis].update()
+            self.axes[axis].pulse(n)
+
+    def pulseTrain(self, axis, count, rate=1000.0):
+        """
+        在后台线程中以固定频率产生count个脉冲
+        :param rate: 脉冲频率，单位Hz
+        :return: 产生脉冲的线程
+        """
+        def run():
+            nexttime = time.time()
+            for _ in range(count):
+                self.pulse(axis)
+                nexttime += 1.0 / rate
+                delay = nexttime - time.time()
+                if delay > 0:
+                    time.sleep(delay)
+        thread = threading.Thread(target=run)
+        thread.daemon = True
+        thread.start()
+        return thread
+
+    def dispatch(self, message):
+        method = message.get('method')
+        params = message.get('params', [])
+        reply = {'jsonrpc': '2.0', 'id': message.get('id')}
+        handler = self._handlers.get(method)
+        if handler is None:
+            reply['error'] = {'code': -32601, 'message': 'Method not found: {}'.format(method)}
+            return reply
+        with self._lock:
+            now = time.time()
+            for axis in self.axes:
+                axis.update(now)
+            try:
+                reply['result'] = handler(*params)
+            except (IndexError, TypeError, ValueError):
+                reply['result'] = [ERR_PARAM]
+        return reply
+
+    def _buildHandlers(self):
+        handlers = {}
+
+        def axisGetter(attr):
+            def get(axis, *args):
+                if not 0 <= axis < len(self.axes):
+                    return [ERR_AXIS]
+                value = getattr(self.axes[axis], attr)
+                return [0, value() if callable(value) else value]
+            return get
+
+        def axisSetter(attr, convert):
+            def set(axis, value):
+                if not 0 <= axis < len(self.axes):
+                    return [ERR_AXIS]
+                setattr(self.axes[axis], attr, convert(value))
+                return [0]
+            return set
+
+        def rtinGetter(key):
+            def get(axis, *args):
+                if not 0 <= axis < len(self.axes):
+                    return [ERR_AXIS]
+                return [0, self.axes[axis].rtin[key]]
+            return get
+
+        def rtinSetter(key, convert):
+            def set(axis, value):
+                if not 0 <= axis < len(self.axes):
+                    return [ERR_AXIS]
+                self.axes[axis].rtin[key] = convert(value)
+                return [0]
+            return set
+
+        def position(axis):
+            if not 0 <= axis < len(self.axes):
+                return [ERR_AXIS]
+            return [0, int(round(self.axes[axis].position))]
+
+        def setReset(axis):
+            if not 0 <= axis < len(self.axes):
+                return [ERR_AXIS]
+            self.axes[axis].position = self.axes[axis].target = 0.0
+            return [0]
+
+        def setNSteps(axis, backward, n):
+            if not 0 <= axis < len(self.axes):
+                return [ERR_AXIS]
+            a = self.axes[axis]
+            if a.output:
+                step = a.stepsize * a.amplitude / 45000.0 * int(n) * (-1 if backward else 1)
+                a.position = min(max(a.position + step, a.limits[0]), a.limits[1])
+            return [0]
+
+        def setContinuous(attr, other):
+            def set(axis, enable):
+                if not 0 <= axis < len(self.axes):
+                    return [ERR_AXIS]
+                setattr(self.axes[axis], attr, bool(enable))
+                if enable:
+                    setattr(self.axes[axis], other, False)
+                return [0]
+            return set
+
+        def statusTargetRange(axis):
+            if not 0 <= axis < len(self.axes):
+                return [ERR_AXIS]
+            a = self.axes[axis]
+            return [0, abs(a.position - a.target) <= a.targetRange]
+
+        def ok(*args):
+            return [0]
+
+        amc = 'com.attocube.amc.'
+        handlers.update({
+            'getLockStatus': lambda: [False, True],
+            'lock': ok,
+            'grantAccess': ok,
+            'unlock': ok,
+            'com.attocube.system.errorNumberToString':
+                lambda language, errorNumber: [_ERROR_STRINGS.get(errorNumber, 'Unknown error')],
+            amc + 'control.setControlOutput': axisSetter('output', bool),
+            amc + 'control.getControlOutput': axisGetter('output'),
+            amc + 'control.setControlAmplitude': axisSetter('amplitude', int),
+            amc + 'control.getControlAmplitude': axisGetter('amplitude'),
+            amc + 'control.setControlFrequency': axisSetter('frequency', int),
+            amc + 'control.getControlFrequency': axisGetter('frequency'),
+            amc + 'control.getActorParametersActorname': lambda axis: [0, 'SIM'],
+            amc + 'control.getActorType': lambda axis: [0, 0],
+            amc + 'control.setReset': setReset,
+            amc + 'control.setControlMove': axisSetter('move', bool),
+            amc + 'control.getControlMove': axisGetter('move'),
+            amc + 'move.setNSteps': setNSteps,
+            amc + 'move.setControlContinousFwd': setContinuous('continuousFwd', 'continuousBkwd'),
+            amc + 'move.getControlContinousFwd': axisGetter('continuousFwd'),
+            amc + 'move.setControlContinousBkwd': setContinuous('continuousBkwd', 'continuousFwd'),
+            amc + 'move.getControlContinousBkwd': axisGetter('continuousBkwd'),
+            amc + 'move.setControlTargetPosition': axisSetter('target', int),
+            amc + 'move.getControlTargetPosition': axisGetter('target'),
+            amc + 'move.getPosition': position,
+            amc + 'status.getStatusReference': lambda axis: [0, True],
+            amc + 'status.getStatusMoving': axisGetter('statusMoving'),
+            amc + 'status.getStatusConnected': lambda axis: [0, 0 <= axis < len(self.axes)],
+            amc + 'status.getStatusTargetRange': statusTargetRange,
+            amc + 'status.getStatusEotFwd': axisGetter('eotFwd'),
+            amc + 'status.getStatusEotBkwd': axisGetter('eotBkwd'),
+            amc + 'control.setControlTargetRange': axisSetter('targetRange', int),
+            amc + 'control.getControlTargetRange': axisGetter('targetRange'),
+            amc + 'move.setControlEotOutputDeactive': axisSetter('eotOutputDeactive', bool),
+            amc + 'move.getControlEotOutputDeactive': axisGetter('eotOutputDeactive'),
+            'com.attocube.system.getSerialNumber': lambda: [self.serialNumber],
+            'com.attocube.system.getDevicename': lambda: [self.devicename],
+            'com.attocube.system.getFirmwareVersion': lambda: ['simulator'],
+            amc + 'description.getDeviceType': lambda: ['AMC100'],
+            amc + 'rtin.setRealTimeInMode': rtinSetter('mode', int),
+            amc + 'rtin.getRealTimeInMode': rtinGetter('mode'),
+            amc + 'rtin.setRealTimeInFeedbackLoopMode': rtinSetter('loop', int),
+            amc + 'rtin.getRealTimeInFeedbackLoopMode': rtinGetter('loop'),
+            amc + 'rtin.setRealTimeInChangePerPulse': rtinSetter('changePerPulse', int),
+            amc + 'rtin.getRealTimeInChangePerPulse': rtinGetter('changePerPulse'),
+            amc + 'rtin.setRealTimeInStepsPerPulse': rtinSetter('stepsPerPulse', int),
+            amc + 'rtin.getRealTimeInStepsPerPulse': rtinGetter('stepsPerPulse'),
+            amc + 'rtin.setControlMoveGPIO': rtinSetter('move', bool),
+            amc + 'rtin.getControlMoveGPIO': rtinGetter('move'),
+            amc + 'rtin.apply': ok,
+        })
+        return handlers
+
+
+def benchmark(host='127.0.0.1', port=AMC.TCP_PORT, n=1000):
+    """
+    测试驱动的吞吐量与移动的延迟
+    :param host: 设备(或模拟器)的地址
+    :param port: 设备(或模拟器)的端口
+    :param n: 每项测试的请求次数
+    :return: 字典，保存测试结果
+    """
+    results = {}
+    client = AMC.AMCClient(host, port)
+    try:
+        begin = time.perf_counter()
+        for _ in range(n):
+            client.getPosition(0)
+        results['sequential calls/s'] = n / (time.perf_counter() - begin)
+
+        begin = time.perf_counter()
+        ids = [client.request('getPosition', [0]) for _ in range(n)]
+        for id in ids:
+            client.result(id)
+        results['pipelined calls/s'] = n / (time.perf_counter() - begin)
+
+        begin = time.perf_counter()
+        for _ in range(n // 3):
+            client.batch([('getPosition', [i]) for i in range(3)])
+        results['batched 3-axis polls/s'] = (n // 3) / (time.perf_counter() - begin)
+    finally:
+        client.close()
+
+    from fcre.pztcontroller import AMCPZTController
+    pzt = AMCPZTController('benchmark')
+    pzt.connect(host, port=port)
+    try:
+        start = pzt.getPosition()
+        begin = time.perf_counter()
+        pzt.move([p + 10000 for p in start])
+        results['3-axis 10um move s'] = time.perf_counter() - begin
+        pzt.move(start)
+    finally:
+        pzt.close()
+    return results
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='AMC100 JSON-RPC simulator')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=AMC.TCP_PORT)
+    parser.add_argument('--numaxes', type=int, default=3)
+    parser.add_argument('--latency', type=float, default=0.0, help='network latency of each reply in s')
+    parser.add_argument('--benchmark', action='store_true', help='run the driver benchmark and exit')
+    args = parser.parse_args()
+
+    sim = AMCSimulator(args.host, args.port, numaxes=args.numaxes, latency=args.latency).start()
+    print('AMC100 simulator listening on {}:{}'.format(args.host, sim.port))
+    if args.benchmark:
+        for key, value in benchmark(args.host, sim.port).items():
+            print('{}: {:.4g}'.format(key, value))
+        sim.stop()
+    else:
+        try:
+            while True:
+                time.sleep(1)
+        except KeyboardInterrupt:
+            sim.stop()
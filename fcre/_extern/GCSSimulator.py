@@ -0,0 +1,300 @@
+# -*- coding: utf-8 -*-
+"""
+PI GCS设备模拟器，实现驱动中使用的pipython.GCSDevice命令，可以代替GCSDevice传入PIPZTController，
+用于在没有实际设备以及PI动态库的情况下测试以及评估驱动的性能。
+
+使用方式：
+    pzt = PIPZTController('pi')
+    pzt.connect('E-727', stages=None, refmode=None, mode='SIM', numaxes=3, latency=0.001)
+    python -m fcre._extern.GCSSimulator --latency 0.001
+    python -m fcre._extern.GCSSimulator --composite
+"""
+
+__all__ = ['GCSError', 'E10_PI_CNTR_STOP', 'SimServoAxis', 'SimGCSDevice', 'benchmark', 'benchmarkComposite']
+
+import argparse
+import math
+import threading
+import time
+from collections import OrderedDict
+
+try:
+    from pipython import GCSError
+except ImportError:
+    class GCSError(Exception):
+        """与pipython.GCSError相同，val为错误码"""
+
+        def __init__(self, value, message=''):
+            super(GCSError, self).__init__(message or 'GCS error {}'.format(value))
+            self.val = value
+
+# 错误码，与pipython.gcserror相同
+E10_PI_CNTR_STOP = 10  # 运动被HLT或STP停止
+E15_PI_CNTR_INVALID_AXIS_IDENTIFIER = 15  # 轴不存在
+E7_PI_CNTR_POS_OUT_OF_LIMITS = 7  # 目标位置超出行程
+
+
+class SimServoAxis(object):
+    """
+    模拟闭环压电轴的伺服动态，所有状态都在被访问时根据经过的时间更新，不需要单独的线程。
+    位置以时间常数tau按指数趋近目标位置，同时速度不超过velocity。
+
+    proprety:
+        position-当前位置，单位um
+        target-目标位置，单位um
+        limits-行程的上下限，单位um
+        velocity-最大速度，单位um/s
+        tau-伺服的时间常数，单位s
+        window-到位窗口，单位um，与目标位置的距离小于window时为到位
+
+    method:
+        __init__-初始化
+        update-按照经过的时间更新位置
+        onTarget-是否到位
+    """
+
+    def __init__(self, position=None, limits=(0.0, 100.0), velocity=1000.0, tau=0.002, window=0.01):
+        self.limits = tuple(limits)
+        if position is None:
+            position = (self.limits[0] + self.limits[1]) / 2.0
+        self.position = float(position)
+        self.target = float(position)
+        self.velocity = velocity
+        self.tau = tau
+        self.window = window
+        self._lastUpdate = time.time()
+
+    def update(self, now=None):
+        if now is None:
+            now = time.time()
+        dt = now - self._lastUpdate
+        self._lastUpdate = now
+        error = self.target - self.position
+        if dt <= 0 or error == 0:
+            return
+        step = error * (1 - math.exp(-dt / self.tau)) if self.tau > 0 else error
+        maxstep = self.velocity * dt
+        if abs(step) > maxstep:
+            step = math.copysign(maxstep, step)
+        self.position += step
+
+    def onTarget(self):
+        return abs(self.target - self.position) <= self.window
+
+
+class SimGCSDevice(object):
+    """
+    模拟的GCSDevice，实现qIDN，qTMN，qTMX，qPOS，MOV，qONT，HLT，STP以及axes，numaxes，
+    每条命令都有可设置的通信延迟。轴的名称与实际控制器相同，为'1', '2', ...
+
+    proprety:
+        devname-控制器的名称
+        latency-每条命令的通信延迟，单位s
+        simaxes-SimServoAxis的列表
+        axes-轴的名称
+        numaxes-轴的个数
+        _lock-锁，保证多线程安全
+
+    method:
+        __init__-初始化
+        qIDN-设备标识
+        qTMN/qTMX-行程的下限与上限
+        qPOS-当前位置
+        MOV-移动到目标位置
+        qONT-是否到位
+        HLT/STP-停止运动，与实际控制器相同会产生错误码10
+        close-关闭连接
+    """
+
+    def __init__(self, devname='E-727', numaxes=3, latency=0.0, serialnum='SIM-GCS', **axiskwargs):
+        self.devname = devname
+        self.latency = latency
+        self.serialnum = serialnum
+        self.simaxes = [SimServoAxis(**axiskwargs) for _ in range(numaxes)]
+        self._axes = [str(i + 1) for i in range(numaxes)]
+        self._connected = True
+        self._lock = threading.RLock()
+
+    @property
+    def axes(self):
+        return list(self._axes)
+
+    @property
+    def numaxes(self):
+        return len(self._axes)
+
+    def IsConnected(self):
+        return self._connected
+
+    def close(self):
+        self._connected = False
+
+    # 与pipython相同，axes可以为None(所有轴)，单个轴或者轴的列表
+    def _axisList(self, axes):
+        if axes is None:
+            return self.axes
+        if isinstance(axes, (str, int)):
+            axes = [axes]
+        axes = [str(axis) for axis in axes]
+        for axis in axes:
+            if axis not in self._axes:
+                raise GCSError(E15_PI_CNTR_INVALID_AXIS_IDENTIFIER)
+        return axes
+
+    # 每条命令都经过通信延迟，然后更新所有轴的状态
+    def _command(self):
+        if not self._connected:
+            raise GCSError(-1, 'Device is not connected')
+        if self.latency:
+            time.sleep(self.latency)
+        now = time.time()
+        for axis in self.simaxes:
+            axis.update(now)
+
+    def _query(self, axes, getter):
+        with self._lock:
+            self._command()
+            return OrderedDict((axis, getter(self.simaxes[self._axes.index(axis)]))
+                               for axis in self._axisList(axes))
+
+    def qIDN(self):
+        with self._lock:
+            self._command()
+            return 'Physik Instrumente, {} simulator, {}, 0.0.0\n'.format(self.devname, self.serialnum)
+
+    def qTMN(self, axes=None):
+        return self._query(axes, lambda axis: axis.limits[0])
+
+    def qTMX(self, axes=None):
+        return self._query(axes, lambda axis: axis.limits[1])
+
+    def qPOS(self, axes=None):
+        return self._query(axes, lambda axis: axis.position)
+
+    def qONT(self, axes=None):
+        return self._query(axes, lambda axis: axis.onTarget())
+
+    def MOV(self, axes, values=None):
+        if isinstance(axes, dict):
+            axes, values = list(axes.keys()), list(axes.values())
+        axes = self._axisList(axes)
+        if not isinstance(values, (list, tuple)):
+            values = [values]
+        with self._lock:
+            self._command()
+            simaxes = [self.simaxes[self._axes.index(axis)] for axis in axes]
+            # 与实际控制器相同，只要有一个目标位置超出行程，所有轴都不移动
+            for axis, value in zip(simaxes, values):
+                if not axis.limits[0] <= value <= axis.limits[1]:
+                    raise GCSError(E7_PI_CNTR_POS_OUT_OF_LIMITS)
+            for axis, value in zip(simaxes, values):
+                axis.target = float(value)
+
+    def HLT(self, axes=None, noraise=False):
+        with self._lock:
+            self._command()
+            for axis in self._axisList(axes):
+                simaxis = self.simaxes[self._axes.index(axis)]
+                simaxis.target = simaxis.position
+        if not noraise:
+            raise GCSError(E10_PI_CNTR_STOP)
+
+    def STP(self, noraise=False):
+        self.HLT(noraise=noraise)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+def benchmark(n=1000, latency=0.0):
+    """
+    测试驱动的查询速度与移动的延迟
+    :param n: 查询的次数
+    :param latency: 每条命令的通信延迟，单位s
+    :return: 字典，保存测试结果
+    """
+    from fcre.pztcontroller import PIPZTController
+    results = {}
+    pzt = PIPZTController('benchmark')
+    pzt.connect('E-727', stages=None, refmode=None, mode='SIM', latency=latency)
+    try:
+        begin = time.perf_counter()
+        for _ in range(n):
+            pzt.getPosition()
+        results['getPosition calls/s'] = n / (time.perf_counter() - begin)
+
+        start = pzt.getPosition()
+        begin = time.perf_counter()
+        pzt.move([p + 10 for p in start])
+        results['3-axis 10um move s'] = time.perf_counter() - begin
+        pzt.move(start)
+    finally:
+        pzt.close()
+    return results
+
+
+def benchmarkComposite(latency=0.0):
+    """
+    以AMCSimulator为粗调、SimGCSDevice为精调，测试CompositePZTController的同步与非阻塞移动、取消以及停止
+    :param latency: 每条命令(请求)的通信延迟，单位s
+    :return: 字典，保存测试结果
+    """
+    from fcre._extern.AMCSimulator import AMCSimulator
+    from fcre.pztcontroller import AMCPZTController, PIPZTController, CompositePZTController
+    results = {}
+    with AMCSimulator(port=0, latency=latency) as sim:
+        coarse = AMCPZTController('benchmark-coarse')
+        coarse.connect('127.0.0.1', port=sim.port)
+        fine = PIPZTController('benchmark-fine')
+        fine.connect('E-727', stages=None, refmode=None, mode='SIM', latency=latency)
+        stack = CompositePZTController('benchmark-stack')
+        stack.connect(coarse, fine, scale=1000.0)
+        try:
+            start = stack.getPosition()
+            begin = time.perf_counter()
+            stack.move([start[0] + 10000] + list(start[1:]))
+            results['fine only move s'] = time.perf_counter() - begin
+
+            positions = []
+            begin = time.perf_counter()
+            handle = stack.moveAsync([start[0] + 100000] + list(start[1:]), callback=positions.append)
+            handle.result(60)
+            results['coarse+fine moveAsync s'] = time.perf_counter() - begin
+            results['moveAsync progress reports'] = len(positions)
+            results['moveAsync final error nm'] = abs(stack.getPosition()[0] - start[0] - 100000)
+
+            handle = stack.moveAsync(start)
+            time.sleep(0.1)
+            begin = time.perf_counter()
+            handle.cancel()
+            handle.wait(60)
+            results['cancel s'] = time.perf_counter() - begin
+            assert handle.state() == 'cancelled', handle.state()
+
+            handle = stack.moveAsync(start)
+            time.sleep(0.1)
+            begin = time.perf_counter()
+            stack.halt()
+            results['halt s'] = time.perf_counter() - begin
+            handle.wait(60)
+            assert handle.state() == 'stopped', handle.state()
+        finally:
+            stack.close()
+            fine.close()
+            coarse.close()
+    return results
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='PI GCS device simulator')
+    parser.add_argument('--n', type=int, default=1000)
+    parser.add_argument('--latency', type=float, default=0.0, help='latency of each command in s')
+    parser.add_argument('--composite', action='store_true', help='benchmark CompositePZTController with AMC and PI')
+    args = parser.parse_args()
+
+    results = benchmarkComposite(args.latency) if args.composite else benchmark(args.n, args.latency)
+    for key, value in results.items():
+        print('{}: {:.4f}'.format(key, value))
@@ -1,8 +1,12 @@
 # -*- coding: utf-8 -*-
 
-__all__ = ['Experiment', 'Train']
+__all__ = ['Experiment', 'Servo', 'Jacobian', 'Train']
 
 import threading
+import time
+from collections import deque, namedtuple
+
+import numpy as np
 
 class Experiment(threading.Thread):
     """
@@ -45,6 +49,287 @@ class Experiment(threading.Thread):
     def isRunning(self):
         return self._running
 
+# 伺服每次迭代的记录，error为轴上的误差，correction为实际的移动量，
+# acquire/compute/move/total分别为拍摄、计算、移动以及整个迭代的耗时，单位s
+ServoStep = namedtuple('ServoStep', ['timestamp', 'error', 'correction', 'acquire', 'compute', 'move', 'total'])
+
+class Servo(Experiment):
+    """
+    闭环质心伺服，以固定的频率读取相机图像，由Evaluation计算质心偏移，
+    经增益矩阵转换为各轴的误差，再经PID计算修正量并相对移动PZT。
+
+    proprety:
+        controller-PZTController对象
+        cameras-包含Camera对象的序列
+        pretreatment-Pretreatment对象
+        evaluation-Evaluation对象
+        gain-增益矩阵，形状为(轴数, 质心偏移的总长度)，或者具有compute方法的对象(例如Train)
+        interval-迭代间隔，单位s
+        kp, ki, kd-PID参数
+        deadband-死区，误差绝对值小于此值的轴不修正
+        maxstep-每次迭代每个轴的最大移动量，默认为None不限制
+        ilimit-积分项的最大绝对值，默认为None不限制
+        setpoint-质心偏移的目标值，默认为0
+        steps-最近的迭代记录ServoStep
+        error-运行过程中产生的异常
+        _integral-积分项
+        _last-上一次的误差
+    method:
+        __init__-初始化
+        reset-清除积分项与微分项
+        step-进行一次迭代
+        run-以固定的频率迭代
+        getLatency-统计迭代的耗时
+    """
+    def __init__(self, controller, cameras, pretreatment, evaluation, gain, rate=10,
+                 kp=1.0, ki=0.0, kd=0.0, deadband=0.0, maxstep=None, ilimit=None, setpoint=None, history=256):
+        super(Servo, self).__init__(self.step)
+        self.daemon = True
+        self.controller = controller
+        self.cameras = tuple(cameras)
+        self.pretreatment = pretreatment
+        self.evaluation = evaluation
+        self.gain = gain
+        self.interval = 1.0 / rate
+        self.kp, self.ki, self.kd = kp, ki, kd
+        self.deadband = deadband
+        self.maxstep = maxstep
+        self.ilimit = ilimit
+        self.setpoint = setpoint
+        self.steps = deque(maxlen=history)
+        self.error = None
+        self.reset()
+
+    def reset(self):
+        self._integral = None
+        self._last = None
+
+    def _axisError(self, cdeviations):
+        e = np.concatenate([np.ravel(d) for d in cdeviations])
+        if self.setpoint is not None:
+            e = e - np.asarray(self.setpoint, dtype=float)
+        if hasattr(self.gain, 'compute'):
+            # 减去目标值后按照原来每个相机的形状传入compute
+            deviations = []
+            begin = 0
+            for d in cdeviations:
+                d = np.asarray(d)
+                deviations.append(e[begin:begin+d.size].reshape(d.shape))
+                begin += d.size
+            return np.asarray(self.gain.compute(deviations), dtype=float)
+        return np.dot(self.gain, e)
+
+    def step(self):
+        """
+        :return: 本次迭代的记录ServoStep
+        """
+        begin = time.time()
+        imgs = [cm.read() for cm in self.cameras]
+        acquired = time.time()
+
+        x = self._axisError(self.evaluation.compute(self.pretreatment.process(imgs)))
+        x[np.abs(x) < self.deadband] = 0
+        if self._integral is None:
+            self._integral = np.zeros_like(x)
+        integral = self._integral + x * self.interval
+        if self.ilimit is not None:
+            integral = np.clip(integral, -self.ilimit, self.ilimit)
+        derivative = np.zeros_like(x) if self._last is None else (x - self._last) / self.interval
+        correction = self.kp * x + self.ki * integral + self.kd * derivative
+        if self.maxstep is not None:
+            limited = np.clip(correction, -self.maxstep, self.maxstep)
+            # anti-windup: 修正量饱和且误差与修正量同向时不再积分
+            saturated = (limited != correction) & (np.sign(x) == np.sign(correction))
+            integral[saturated] = self._integral[saturated]
+            correction = limited
+        correction[x == 0] = 0
+        self._integral = integral
+        self._last = x
+        computed = time.time()
+
+        if np.any(correction):
+            self.controller.moveRel(correction.tolist())
+        end = time.time()
+
+        record = ServoStep(begin, x, correction, acquired - begin, computed - acquired, end - computed, end - begin)
+        self.steps.append(record)
+        return record
+
+    def run(self):
+        nexttime = time.time()
+        while not self._stopped:
+            try:
+                self.step()
+            except Exception as e:
+                print('servo: {}'.format(str(e)))
+                self.error = e
+                self.stop()
+                break
+            nexttime += self.interval
+            delay = nexttime - time.time()
+            if delay < 0:  # 迭代跟不上时不再补偿
+                nexttime = time.time()
+                delay = 0
+            time.sleep(delay)
+        print('伺服结束')
+
+    def getLatency(self):
+        """
+        :return: 字典，acquire/compute/move/total的平均值与最大值，单位s
+        """
+        steps = list(self.steps)
+        if not steps:
+            return {}
+        report = {}
+        for key in ('acquire', 'compute', 'move', 'total'):
+            values = [getattr(s, key) for s in steps]
+            report[key] = {'mean': float(np.mean(values)), 'max': float(np.max(values))}
+        return report
+
+class Jacobian(object):
+    """
+    相机质心偏移与平台位移之间的线性(或仿射)关系，由calibrate逐个移动各轴并用最小二乘拟合得到，
+    可以代替Train，compute为一次矩阵乘法。
+
+    proprety:
+        numaxes-PZT的轴数
+        axes-标定的轴的序号
+        matrix-Jacobian矩阵，形状为(质心偏移的总长度, 标定的轴数)，质心偏移=matrix·位移+offset
+        offset-仿射拟合的常数项，线性拟合时为0
+        residual-拟合的均方根残差
+        _inverse-matrix的伪逆
+    method:
+        __init__-初始化
+        calibrate-移动各轴并测量质心偏移，拟合Jacobian矩阵
+        fit-由位移与质心偏移拟合Jacobian矩阵
+        predict-由位移预测质心偏移
+        compute-计算消除质心偏移所需的各轴移动量
+        save-保存到文件
+        load-从文件中导入
+    """
+
+    def __init__(self, matrix=None, offset=None, axes=None, numaxes=None):
+        self.matrix = None
+        self.offset = None
+        self.residual = None
+        self._inverse = None
+        self.axes = None if axes is None else tuple(axes)
+        self.numaxes = numaxes
+        if matrix is not None:
+            self._setMatrix(np.asarray(matrix, dtype=float), offset)
+
+    def _setMatrix(self, matrix, offset=None):
+        self.matrix = matrix
+        self.offset = np.zeros(matrix.shape[0]) if offset is None else np.asarray(offset, dtype=float)
+        self._inverse = np.linalg.pinv(matrix)
+        if self.axes is None:
+            self.axes = tuple(range(matrix.shape[1]))
+        if self.numaxes is None:
+            self.numaxes = max(self.axes) + 1
+
+    @staticmethod
+    def _measure(cameras, pretreatment, evaluation, repeat):
+        values = []
+        for _ in range(repeat):
+            imgs = [cm.read() for cm in cameras]
+            cdeviations = evaluation.compute(pretreatment.process(imgs))
+            values.append(np.concatenate([np.ravel(d) for d in cdeviations]))
+        return np.mean(values, axis=0)
+
+    def calibrate(self, controller, cameras, pretreatment, evaluation, axes=None,
+                  steps=None, repeat=1, affine=True):
+        """
+        逐个移动各轴并测量质心偏移，结束后返回初始位置
+        :param controller: PZTController对象
+        :param cameras: 包含Camera对象的序列
+        :param pretreatment: Pretreatment对象
+        :param evaluation: Evaluation对象
+        :param axes: 需要标定的轴，默认为None即所有轴
+        :param steps: 每个轴相对于初始位置的位移，单位与控制器相同。默认为None，
+                      即各轴行程的-2%, -1%, 1%, 2%，此时控制器的行程必须已知
+        :param repeat: 每个点拍摄的次数，取平均值
+        :param affine: 是否拟合常数项
+        :return: 均方根残差
+        """
+        start = list(controller.getPosition())
+        self.numaxes = len(start)
+        self.axes = tuple(range(self.numaxes)) if axes is None else tuple(axes)
+        axissteps = {axis: steps for axis in self.axes}
+        if steps is None:
+            _range = controller.getRange()
+            for axis in self.axes:
+                low, high = _range[axis] if axis < len(_range) else (None, None)
+                if low is None or high is None:
+                    raise ValueError('The range of axis {} is unknown, steps must be given.'.format(axis))
+                axissteps[axis] = [f * (high - low) for f in (-0.02, -0.01, 0.01, 0.02)]
+
+        displacements = [np.zeros(len(self.axes))]
+        deviations = [self._measure(cameras, pretreatment, evaluation, repeat)]
+        try:
+            for k, axis in enumerate(self.axes):
+                for step in axissteps[axis]:
+                    controller.moveAxis(axis, start[axis] + step)
+                    displacement = np.zeros(len(self.axes))
+                    displacement[k] = step
+                    displacements.append(displacement)
+                    deviations.append(self._measure(cameras, pretreatment, evaluation, repeat))
+                controller.moveAxis(axis, start[axis])
+        finally:
+            controller.move(start)
+        return self.fit(displacements, deviations, affine)
+
+    def fit(self, displacements, deviations, affine=True):
+        """
+        :param displacements: 位移，形状为(样本数, 标定的轴数)
+        :param deviations: 质心偏移，形状为(样本数, 质心偏移的总长度)
+        :param affine: 是否拟合常数项，否则减去第一个样本(零位移)的质心偏移
+        :return: 均方根残差
+        """
+        x = np.asarray(displacements, dtype=float)
+        y = np.asarray(deviations, dtype=float)
+        if affine:
+            a = np.hstack((x, np.ones((x.shape[0], 1))))
+            coef = np.linalg.lstsq(a, y, rcond=None)[0]
+            matrix, offset = coef[:-1].T, coef[-1]
+        else:
+            coef = np.linalg.lstsq(x, y - y[0], rcond=None)[0]
+            # 常数项为零位移时的质心偏移
+            matrix, offset = coef.T, y[0]
+        self._setMatrix(matrix, offset)
+        self.residual = float(np.sqrt(np.mean((self.predict(x) - y) ** 2)))
+        print('jacobian residual: {}'.format(self.residual))
+        return self.residual
+
+    def predict(self, displacement):
+        return np.dot(np.asarray(displacement, dtype=float), self.matrix.T) + self.offset
+
+    def compute(self, cdeviations):
+        """
+        :param cdeviations: Evaluation.compute的结果
+        :return: 消除质心偏移所需的各轴移动量，未标定的轴为0
+        """
+        e = np.concatenate([np.ravel(d) for d in cdeviations])
+        correction = [0.0] * self.numaxes
+        for axis, value in zip(self.axes, -np.dot(self._inverse, e)):
+            correction[axis] = float(value)
+        return correction
+
+    # np.savez会自动添加.npz后缀，保存与导入使用相同的文件名
+    @staticmethod
+    def _npzPath(path):
+        path = str(path)
+        return path if path.endswith('.npz') else path + '.npz'
+
+    def save(self, path):
+        path = self._npzPath(path)
+        print('save jacobian in {}'.format(path))
+        np.savez(path, matrix=self.matrix, offset=self.offset, axes=np.array(self.axes), numaxes=self.numaxes)
+
+    @classmethod
+    def load(cls, path):
+        data = np.load(cls._npzPath(path))
+        return cls(data['matrix'], data['offset'], data['axes'].tolist(), int(data['numaxes']))
+
 try:
     import keras
     import numpy as np
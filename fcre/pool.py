@@ -8,10 +8,12 @@ __all__ = ['DevPool', 'Constant', 'delete']
 import sys
 import threading
 import os
+import time
 from datetime import datetime
 import json
 import importlib
 import importlib.util
+from concurrent.futures import ThreadPoolExecutor
 
 class DevPoolError(Exception):
     """
@@ -51,11 +53,11 @@ def _validate_file_object(file):
 
 # 所有类型对象
 deviceObjects = {
-    'pztcontroller': {'amc': 'AMCPZTController', 'pi': 'PIPZTController'},
+    'pztcontroller': {'amc': 'AMCPZTController', 'pi': 'PIPZTController', 'stack': 'CompositePZTController'},
     'camera': 'Camera',
     'shutter': {'sc': 'SCShutter'}
 }
-deviceKeys = ('amc', 'pi', 'sc')
+deviceKeys = ('amc', 'pi', 'stack', 'sc')
 
 def _getObjectName(_type, _name):
     t0 = deviceObjects[_type]
@@ -87,6 +89,9 @@ class DevPool(object):
         _getDevice-以类型查找的方式获得目标设备
         doSafely-安全地运行设备对象具体方法
         do-运行目标设备对象具体方法
+        connectAll-并行连接并初始化多个设备
+        startupAll-并行运行多个设备的startup
+        stopAll-并行停止所有运动设备，并报告所用的时间
         unregister-移除某个特定设备，为了节省对象创建所需的时间，我们许哟目标设备存在本地映射1，并且具有close()方法
         unregisterAll-全部移除
         delete-删除单例
@@ -246,6 +251,129 @@ class DevPool(object):
             self._print('{}: {}'.format(datetime.now(), str(e)))
             return
 
+    # 每个设备在单独的线程中依次运行steps，返回每个设备的异常，成功时为None
+    def _runParallel(self, type, jobs, callback=None):
+        def run(name, steps):
+            begin = time.perf_counter()
+            for stage, attr, args, kwargs in steps:
+                try:
+                    self.doSafely(type, name, attr, *args, **kwargs)
+                except Exception as e:
+                    self._print('{}: {} {} failed after {:.2f} s'.format(datetime.now(), name, stage,
+                                                                          time.perf_counter() - begin))
+                    if callback:
+                        callback(name, stage, e)
+                    return e
+                self._print('{}: {} {} finished in {:.2f} s'.format(datetime.now(), name, stage,
+                                                                     time.perf_counter() - begin))
+                if callback:
+                    callback(name, stage, None)
+
+        if not jobs:
+            return {}
+        with ThreadPoolExecutor(max_workers=len(jobs)) as executor:
+            futures = {name: executor.submit(run, name, steps) for name, steps in jobs.items()}
+        return {name: future.result() for name, future in futures.items()}
+
+    def connectAll(self, params, type='pztcontroller', startup=True, callback=None):
+        """
+        并行地连接多个设备，每个设备在单独的线程中依次运行connect与startup(PI设备扫描参考点)，
+        总时间由最慢的设备决定。未注册的设备会先注册。
+        :param params: 字典，键为设备名称，值为connect的参数，字典为命名参数，序列为位置参数
+        :param type: 设备类型
+        :param startup: 连接后是否运行startup
+        :param callback: callback(name, stage, error)，每个设备的每个阶段完成时在对应的线程中调用，
+                         stage为'connect'或'startup'，成功时error为None
+        :return: 字典，键为设备名称，值为None(成功)或者产生的异常
+        """
+        for name in params:
+            if not self._getDevice(type, name):
+                self.register(type, name)
+        jobs = {}
+        for name, param in params.items():
+            if isinstance(param, dict):
+                args, kwargs = (), param
+            else:
+                args, kwargs = tuple(param), {}
+            jobs[name] = [('connect', 'connect', args, kwargs)]
+            if startup:
+                jobs[name].append(('startup', 'startup', (), {}))
+        begin = time.perf_counter()
+        results = self._runParallel(type, jobs, callback)
+        failed = [name for name, error in results.items() if error is not None]
+        self._print('{}: connectAll finished in {:.2f} s, failed: {}'.format(datetime.now(),
+                                                                           time.perf_counter() - begin, failed))
+        return results
+
+    def startupAll(self, type='pztcontroller', names=None, callback=None):
+        """
+        并行地运行多个已连接设备的startup
+        :param type: 设备类型
+        :param names: 设备名称的序列，默认为None即该类型的所有设备
+        :param callback: 与connectAll相同
+        :return: 字典，键为设备名称，值为None(成功)或者产生的异常
+        """
+        if names is None:
+            names = list(self._devicesnames.get(type, ()))
+        begin = time.perf_counter()
+        results = self._runParallel(type, {name: [('startup', 'startup', (), {})] for name in names}, callback)
+        failed = [name for name, error in results.items() if error is not None]
+        self._print('{}: startupAll finished in {:.2f} s, failed: {}'.format(datetime.now(),
+                                                                           time.perf_counter() - begin, failed))
+        return results
+
+    def stopAll(self, timeout=1.0):
+        """
+        紧急停止。在每个设备单独的线程中同时调用halt()，通过已经打开的连接直接发出停止命令，
+        不等待正在进行的移动释放锁，被停止的移动以MoveHalted结束。没有halt()方法的设备被忽略，未连接的设备不发出命令。
+        :param timeout: 最长的等待时间，单位s，超时的设备记录为TimeoutError
+        :return: 字典，键为(type, name)，值为字典{'latency': 从调用开始到该设备停止命令完成的时间(s),
+                 'interrupted': 是否停止了正在进行的移动}，产生的异常，或者None(设备未连接)
+        """
+        with DevPool._instance_lock:
+            devs = [(type, dev) for type in self._devices for dev in self._devices[type] if hasattr(dev, 'halt')]
+        results = {}
+        lock = threading.Lock()
+        begin = time.perf_counter()
+
+        def halt(key, dev, interrupted):
+            try:
+                dev.halt()
+                result = {'latency': time.perf_counter() - begin, 'interrupted': interrupted}
+            except Exception as e:
+                result = e
+            with lock:
+                results[key] = result
+
+        threads = []
+        skipped = {}
+        for type, dev in devs:
+            key = (type, dev.name)
+            if hasattr(dev, 'isOpen') and not dev.isOpen():
+                skipped[key] = None
+                continue
+            interrupted = bool(dev.isMoving()) if hasattr(dev, 'isMoving') else False
+            thread = threading.Thread(target=halt, args=(key, dev, interrupted))
+            thread.daemon = True
+            thread.start()
+            threads.append((key, thread))
+        deadline = begin + timeout
+        for key, thread in threads:
+            thread.join(max(0, deadline - time.perf_counter()))
+        # 超时后线程可能仍在写入results，只读取此时的快照
+        with lock:
+            snapshot = dict(results)
+        for key, thread in threads:
+            if key not in snapshot:
+                snapshot[key] = TimeoutError('halt() did not return within {} s'.format(timeout))
+        snapshot.update(skipped)
+        total = time.perf_counter() - begin
+        failed = [key[1] for key, result in snapshot.items() if isinstance(result, Exception)]
+        interrupted = [key[1] for key, result in snapshot.items() if isinstance(result, dict) and result['interrupted']]
+        self._print('{}: stopAll {} devices in {:.1f} ms, interrupted: {}, failed: {}, not connected: {}'.format(
+            datetime.now(), len(threads), total * 1000, interrupted, failed, [key[1] for key in skipped]))
+        return snapshot
+
     def unregister(self, type, name):
         target = None
         if type in self._devices:
@@ -1,15 +1,21 @@
 # -*- coding: utf-8 -*-
 
-__all__ = ['PIPZTController', 'showPortInfo', 'AMCPZTController']
+__all__ = ['PIPZTController', 'showPortInfo', 'AMCPZTController', 'AsyncAMCPZTController', 'MoveHandle',
+           'MotionArbiter', 'CompositePZTController']
 
 import os
+import json
 from abc import abstractmethod, ABCMeta
 from textwrap import dedent
 import time
 import threading
+import asyncio
 from platform import architecture
 import copy
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
 
+import numpy as np
 import serial.tools.list_ports
 
 class OutOfRange(Exception):
@@ -17,6 +23,351 @@ class OutOfRange(Exception):
     The target position is larger than the movable range of the piezoelectric guide.
     """
 
+class MoveCancelled(Exception):
+    """
+    The move was cancelled by MoveHandle.cancel().
+    """
+
+class MoveHalted(MoveCancelled):
+    """
+    The move was stopped by halt() before reaching its targets.
+    """
+
+# 采样结果，timestamp为采样时间，position/moving/eot为各轴的位置、移动状态以及EOT状态
+Sample = namedtuple('Sample', ['timestamp', 'position', 'moving', 'eot'])
+
+class SampleRing(object):
+    """
+    固定长度的环形缓冲区，只有一个写入者(采样线程)，读者不需要加锁。
+    写入者先写入槽位再增加计数，读者根据计数读取已经写入的槽位。
+
+    proprety:
+        _slots-保存采样结果的槽位
+        _count-已经写入的采样个数
+
+    method:
+        __init__-初始化
+        put-写入一个采样
+        latest-获得最新的采样
+        recent-获得最近的多个采样，按时间顺序排列
+    """
+
+    def __init__(self, size=256):
+        self._slots = [None] * size
+        self._count = 0
+
+    def put(self, sample):
+        self._slots[self._count % len(self._slots)] = sample
+        self._count += 1
+
+    def latest(self):
+        count = self._count
+        if not count:
+            return None
+        return self._slots[(count - 1) % len(self._slots)]
+
+    def recent(self, n=None):
+        count = self._count
+        size = len(self._slots)
+        if n is None or n > min(count, size - 1):
+            n = min(count, size - 1)  # 留出一个槽位，防止读取时被覆盖
+        return [self._slots[i % size] for i in range(count - n, count)]
+
+class PZTSampler(threading.Thread):
+    """
+    PZT控制器的后台采样线程，以固定频率查询所有轴的位置、移动状态以及EOT状态，
+    并将带时间戳的采样写入环形缓冲区中。
+
+    proprety:
+        controller-目标PZT控制器
+        interval-采样间隔，单位s
+        ring-环形缓冲区
+        _stopEvent-线程停止事件
+
+    method:
+        __init__-初始化
+        run-线程运行函数
+        stop-停止线程
+    """
+
+    def __init__(self, controller, rate=10, size=256):
+        super(PZTSampler, self).__init__()
+        self.daemon = True
+        self.controller = controller
+        self.interval = 1.0 / rate
+        self.ring = SampleRing(size)
+        self._stopEvent = threading.Event()
+
+    def run(self):
+        nexttime = time.time()
+        while not self._stopEvent.is_set():
+            if not self.controller.device:
+                break
+            try:
+                position, moving, eot = self.controller._sample_d()
+                self.ring.put(Sample(time.time(), position, moving, eot))
+            except Exception as e:
+                print('{} sampler: {}'.format(self.controller.name, str(e)))
+            nexttime += self.interval
+            delay = nexttime - time.time()
+            if delay < 0:  # 采样跟不上时不再补偿
+                nexttime = time.time()
+                delay = 0
+            self._stopEvent.wait(delay)
+
+    def stop(self):
+        self._stopEvent.set()
+
+class AdaptivePoll(object):
+    """
+    自适应的轮询间隔。根据相邻两次采样估计各轴的速度，预测到达目标位置的时间，
+    距离目标较远时以较长的间隔轮询，接近目标时以较短的间隔轮询。
+
+    proprety:
+        mindelay-轮询间隔的下限，单位s
+        maxdelay-轮询间隔的上限，单位s
+        factor-预测时间的比例，小于1时提前轮询，防止错过到达的时刻
+        _last-字典，保存各轴上一次采样的(时间, 位置)
+
+    method:
+        __init__-初始化
+        next-根据当前采样计算下一次轮询前需要等待的时间
+    """
+
+    def __init__(self, mindelay=0.002, maxdelay=0.1, factor=0.5):
+        self.mindelay = mindelay
+        self.maxdelay = maxdelay
+        self.factor = factor
+        self._last = {}
+
+    def next(self, now, positions, distances):
+        """
+        :param now: 采样时间
+        :param positions: 字典，各个仍在移动的轴的当前位置
+        :param distances: 字典，各个仍在移动的轴距离到达目标还需移动的距离
+        :return: 下一次轮询前需要等待的时间，单位s
+        """
+        eta = None
+        for axis, pos in positions.items():
+            last = self._last.get(axis)
+            self._last[axis] = (now, pos)
+            if last is None or now <= last[0]:
+                eta = 0  # 还没有速度估计，尽快进行下一次采样
+                continue
+            velocity = abs(pos - last[1]) / (now - last[0])
+            if velocity > 0:
+                t = max(distances[axis], 0) / velocity
+                eta = t if eta is None else min(eta, t)
+        if eta is None:  # 所有的轴都没有移动
+            return self.maxdelay
+        return min(max(self.factor * eta, self.mindelay), self.maxdelay)
+
+class MoveHandle(object):
+    """
+    非阻塞移动的句柄，由moveAsync/moveRelAsync返回，移动在子线程中运行。
+
+    proprety:
+        targets-目标位置
+        position-最近一次轮询得到的位置
+        _callbacks-进度回调函数列表，每次轮询时以当前位置为参数调用
+        _doneEvent-移动结束事件
+        _cancelEvent-取消事件
+        _exception-移动过程中产生的异常
+        _newTargets-移动过程中修改的目标位置，由等待函数在下一次轮询时取走
+
+    method:
+        __init__-初始化
+        addCallback-添加进度回调函数
+        retarget-修改正在进行的移动的目标位置
+        done-判断移动是否结束
+        wait-等待移动结束
+        cancel-取消移动，停止驱动
+        cancelled-判断是否已经取消
+        exception-返回移动过程中产生的异常
+        result-等待移动结束，若移动失败则抛出相应的异常(例如OutOfRange)
+        state-返回移动的状态
+    """
+
+    def __init__(self, targets, callback=None):
+        self.targets = tuple(targets)
+        self.position = None
+        self._callbacks = [callback] if callback else []
+        self._doneEvent = threading.Event()
+        self._cancelEvent = threading.Event()
+        self._exception = None
+        self._newTargets = None
+
+    def addCallback(self, callback):
+        self._callbacks.append(callback)
+
+    def retarget(self, targets):
+        """
+        修改目标位置，等待函数在下一次轮询时向设备发出新的目标位置，不需要重新开始移动
+        :param targets: 新的目标位置，需要事先检查是否超出范围
+        """
+        self._newTargets = tuple(targets)
+
+    def done(self):
+        return self._doneEvent.is_set()
+
+    def wait(self, timeout=None):
+        """
+        :param timeout: 最长等待时间，单位s，默认为None一直等待
+        :return: 移动结束返回True，超时返回False
+        """
+        return self._doneEvent.wait(timeout)
+
+    def cancel(self):
+        """
+        取消移动，等待函数在下一次轮询时停止驱动
+        :return: 移动尚未结束时返回True
+        """
+        if self.done():
+            return False
+        self._cancelEvent.set()
+        return True
+
+    def cancelled(self):
+        return self._cancelEvent.is_set()
+
+    def exception(self, timeout=None):
+        if not self.wait(timeout):
+            raise TimeoutError('move is not finished after {} seconds'.format(timeout))
+        return self._exception
+
+    def result(self, timeout=None):
+        exception = self.exception(timeout)
+        if exception is not None:
+            raise exception
+        return self.position
+
+    def state(self):
+        """
+        :return: 'moving', 'done', 'stopped'(被halt停止), 'cancelled', 'outofrange'或'error'
+        """
+        if not self.done():
+            return 'moving'
+        if self._exception is None:
+            return 'done'
+        if isinstance(self._exception, MoveHalted):
+            return 'stopped'
+        if isinstance(self._exception, MoveCancelled):
+            return 'cancelled'
+        if isinstance(self._exception, OutOfRange):
+            return 'outofrange'
+        return 'error'
+
+    # 由等待函数在每次轮询时调用，报告进度，取消时抛出MoveCancelled，
+    # 返回移动过程中修改的目标位置，没有修改时返回None
+    def _progress(self, position):
+        self._report(position)
+        targets = self._takeRetarget()
+        if targets is not None:
+            self.targets = targets
+        return targets
+
+    # 只报告进度与检查是否取消，不取走修改的目标位置
+    def _report(self, position):
+        self.position = position
+        for callback in self._callbacks:
+            try:
+                callback(position)
+            except Exception as e:
+                print(str(e))
+        if self._cancelEvent.is_set():
+            raise MoveCancelled('move to {} is cancelled'.format(str(self.targets)))
+
+    def _takeRetarget(self):
+        targets, self._newTargets = self._newTargets, None
+        return targets
+
+    def _run(self, move, kwargs):
+        try:
+            move(self.targets, handle=self, **kwargs)
+        except Exception as e:
+            self._exception = e
+        finally:
+            self._doneEvent.set()
+
+class MotionArbiter(object):
+    """
+    最新优先的移动仲裁器。submit提交的目标只保留最新的一个，移动过程中提交的目标
+    直接修改正在进行的移动的目标位置(AMC: setTargetPosition, PI: MOV)，而不是排队等待。
+
+    proprety:
+        controller-PZTController对象
+        lastHandle-最近一次移动的MoveHandle，可以从中获得移动的结果
+        _kwargs-move的其他参数
+        _cond-条件变量，保护_pending与_handle
+        _pending-等待执行的目标位置
+        _handle-正在进行的移动的MoveHandle
+        _closed-是否已经关闭
+        _thread-执行移动的线程
+
+    method:
+        __init__-初始化并启动线程
+        submit-提交目标位置
+        wait-等待所有提交的目标执行完毕
+        close-关闭仲裁器，不再执行新的目标
+    """
+
+    def __init__(self, controller, **kwargs):
+        self.controller = controller
+        self.lastHandle = None
+        self._kwargs = kwargs
+        self._cond = threading.Condition()
+        self._pending = None
+        self._handle = None
+        self._closed = False
+        self._thread = threading.Thread(target=self._run)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def submit(self, targets):
+        """
+        提交目标位置，立即返回。超出范围时抛出OutOfRange
+        """
+        targets = self.controller._checkTargets(targets)
+        with self._cond:
+            if self._closed:
+                return
+            if self._handle is not None:
+                self._handle.retarget(targets)
+            else:
+                self._pending = targets
+                self._cond.notify_all()
+
+    def wait(self, timeout=None):
+        """
+        :return: 所有提交的目标执行完毕返回True，超时返回False
+        """
+        with self._cond:
+            return self._cond.wait_for(lambda: self._pending is None and self._handle is None, timeout)
+
+    def close(self):
+        with self._cond:
+            self._closed = True
+            self._pending = None
+            self._cond.notify_all()
+
+    def _run(self):
+        while True:
+            with self._cond:
+                self._cond.wait_for(lambda: self._pending is not None or self._closed)
+                if self._closed:
+                    return
+                handle = self._handle = MoveHandle(self._pending)
+                self._pending = None
+            handle._run(self.controller.move, self._kwargs)
+            with self._cond:
+                self._handle = None
+                self.lastHandle = handle
+                # 等待函数最后一次轮询之后才提交的目标
+                targets = handle._takeRetarget()
+                if targets is not None and self._pending is None:
+                    self._pending = targets
+                self._cond.notify_all()
+
 def showPortInfo():
     """
     查看串口的信息
@@ -39,8 +390,12 @@ class PZTController(metaclass=ABCMeta):
         device-目标设备对象
         _info-字典类型，保存设备对象主要信息
         _device_info-字典类型，保存连接设备的信息
-        _lock-锁，保证多线程安全
+        _lock-命令锁，移动与设置参数时持有，保证同一时刻只有一个命令
+        _ioLock-通信锁，每次与设备通信时短暂持有，状态查询只需要此锁，不会被移动阻塞
         _moveState-移动状态
+        _sampler-后台采样线程
+        _arbiter-最新优先的移动仲裁器，由moveLatest创建
+        _haltCount-halt的调用次数，移动结束时与开始时不同说明移动被停止
 
     method:
         __init__-初始化
@@ -57,7 +412,20 @@ class PZTController(metaclass=ABCMeta):
         setStartPosition-设置初始位置
         getPosition-获得当前的位置
         getDeviation-获得当前位置距离设备的偏移
+        startSampler-启动后台采样线程
+        stopSampler-停止后台采样线程
+        getSample-获得最新的采样
+        getSamples-获得最近的多个采样
         move-以绝对坐标的形式移动到目标位置
+        moveRel-以相对坐标的形式移动
+        moveAsync-以非阻塞的方式移动，返回MoveHandle
+        moveRelAsync-以非阻塞的方式相对移动，返回MoveHandle
+        moveAxis-只移动单个轴到目标位置
+        moveAxisRel-只将单个轴移动相对距离
+        moveLatest-提交目标位置，只执行最新的目标，移动过程中直接修改目标位置
+        getLatestHandle-返回moveLatest最近一次结束的移动的MoveHandle
+        stopArbiter-关闭移动仲裁器
+        halt-紧急停止所有轴，不等待正在进行的移动，DevPool.stopAll同时调用所有设备的halt
         close-关闭物理设备
     """
 
@@ -71,6 +439,10 @@ class PZTController(metaclass=ABCMeta):
         self._device_info = {}
         self._moveState = None
         self._lock = threading.RLock()
+        self._ioLock = threading.RLock()
+        self._sampler = None
+        self._arbiter = None
+        self._haltCount = 0
 
     @abstractmethod
     def setNumaxes_d(self):
@@ -94,11 +466,10 @@ class PZTController(metaclass=ABCMeta):
         return self._moveState
 
     def isOpen(self):
-        with self._lock:
-            if not self.device:
-                return False
-            else:
-                return True
+        if not self.device:
+            return False
+        else:
+            return True
 
     def getStartPosition(self):
         return copy.deepcopy(self._info['startPosition'])
@@ -107,15 +478,14 @@ class PZTController(metaclass=ABCMeta):
         return copy.deepcopy(self._info['range'])
 
     def getInit(self):
-        with self._lock:
-            return {'numaxes': self._info['numaxes'],
-                    'startPosition': self.getStartPosition(),
-                    'range': self.getRange()}
+        return {'numaxes': self._info['numaxes'],
+                'startPosition': self.getStartPosition(),
+                'range': self.getRange()}
 
     def getInfo(self):
-        with self._lock:
-            return {'position': self.getPosition(),
-                    'deviation': self.getDeviation()}
+        position = self._currentPosition()
+        return {'position': position,
+                'deviation': self.getDeviation(position=position)}
 
     def getAllInfo(self):
         with self._lock:
@@ -163,27 +533,127 @@ class PZTController(metaclass=ABCMeta):
             self._info['startPosition'] = self.getPosition()
             print('start pos is: {}'.format(str(self._info['startPosition'])))
 
-    def getDeviation(self, centers=None):
+    def getDeviation(self, centers=None, position=None):
+        if not self.device:
+            return
+        if centers is None:
+            centers = self._info['startPosition']
+        if position is None:
+            position = self._currentPosition()
+        if position is None:
+            return
+        deviation = [p - centers[ind] for ind, p in enumerate(position)]
+        self._info['deviation'] = deviation
+        return tuple(deviation)
+
+    def startSampler(self, rate=10, size=256):
+        """
+        启动后台采样线程，此后getInfo以及getDeviation直接读取最新的采样，不再访问设备
+        :param rate: 采样频率，单位Hz
+        :param size: 环形缓冲区的长度
+        """
         with self._lock:
             if not self.device:
                 return
-            if centers is None:
-                centers = self._info['startPosition']
-            deviation = []
-            pos = self.getPosition()
-            for ind, p in enumerate(pos):
-                deviation.append(p - centers[ind])
-                self._info['deviation'] = deviation
-            return tuple(deviation)
+            self.stopSampler()
+            self._sampler = PZTSampler(self, rate, size)
+            self._sampler.start()
+
+    def stopSampler(self):
+        # 不等待线程结束，防止与持有_lock的调用者互相等待
+        sampler, self._sampler = self._sampler, None
+        if sampler is not None:
+            sampler.stop()
+
+    def getSample(self):
+        """
+        :return: 最新的采样Sample，没有运行采样线程时返回None
+        """
+        sampler = self._sampler
+        if sampler is None:
+            return None
+        return sampler.ring.latest()
+
+    def getSamples(self, n=None):
+        """
+        :param n: 采样个数，默认为缓冲区中所有的采样
+        :return: 最近的采样Sample列表，按时间顺序排列
+        """
+        sampler = self._sampler
+        if sampler is None:
+            return []
+        return sampler.ring.recent(n)
+
+    def _currentPosition(self):
+        # 采样足够新时直接使用采样结果，否则查询设备
+        sampler = self._sampler
+        if sampler is not None and sampler.is_alive():
+            sample = sampler.ring.latest()
+            if sample is not None and time.time() - sample.timestamp < 2 * sampler.interval:
+                return sample.position
+        return self.getPosition()
+
+    def _sample_d(self):
+        """
+        采样线程调用的方法，子类可以覆盖此方法以一次查询获得所有状态
+        :return: (position, moving, eot)，无法获得的状态为None
+        """
+        return self.getPosition(), None, None
     
     @abstractmethod
     def getPosition(self):
+        """
+        获得当前位置，只能持有_ioLock，保证移动过程中也能查询
+        """
         pass
 
     @abstractmethod
     def move(self, targets):
         pass
 
+    def moveAxis(self, axis, target, **kwargs):
+        """
+        只移动单个轴，其他轴保持不动。子类应该实现只对此轴发出命令并等待的方法
+        :param axis: 轴的序号，从0开始
+        :param target: 目标位置
+        """
+        with self._lock:
+            if not self.device:
+                return
+            targets = list(self.getPosition())
+            targets[axis] = target
+            self.move(targets, **kwargs)
+
+    def moveAxisRel(self, axis, reltarget, **kwargs):
+        with self._lock:
+            if not self.device:
+                return
+            pos = self.getPosition()[axis]
+            self.moveAxis(axis, float(pos+reltarget), **kwargs)
+
+    def _checkTargets(self, targets):
+        """
+        检查所有轴的目标位置
+        :return: 设备可以接受的目标位置列表
+        """
+        if len(targets) != self._info['numaxes']:
+            raise TypeError('The number of axes set is not equal to the' 
+                            'number of axes of the device.')
+        return [self._checkAxisTarget(i, target) for i, target in enumerate(targets)]
+
+    def _checkAxisTarget(self, axis, target):
+        """
+        检查单个轴的目标位置是否超出行程，未知(None)的上限或下限不检查，子类可以覆盖此方法以转换目标位置
+        :return: 设备可以接受的目标位置
+        """
+        if not 0 <= axis < self._info['numaxes']:
+            raise TypeError('There is no axis {} in the device.'.format(str(axis)))
+        _range = self._info['range'][axis]
+        if ((_range[1] is not None) and (target > _range[1])) or \
+                ((_range[0] is not None) and (target < _range[0])):
+            raise OutOfRange('Sorry, out of range in axis {}'.format(str(axis)))
+        return target
+
     def moveRel(self, reltargets):
         with self._lock:
             if not self.device:
@@ -192,169 +662,476 @@ class PZTController(metaclass=ABCMeta):
             targets = [float(p+reltarget) for p, reltarget in zip(pos, reltargets)]
             self.move(targets)
 
+    def moveAsync(self, targets, callback=None, **kwargs):
+        """
+        以非阻塞的方式移动到目标位置
+        :param targets: 目标位置
+        :param callback: 进度回调函数，每次轮询时以当前位置为参数调用
+        :param kwargs: move的其他参数，例如timeout
+        :return: MoveHandle对象
+        """
+        handle = MoveHandle(targets, callback)
+        thread = threading.Thread(target=handle._run, args=(self.move, kwargs))
+        thread.daemon = True
+        thread.start()
+        return handle
+
+    def moveRelAsync(self, reltargets, callback=None, **kwargs):
+        pos = self.getPosition()
+        targets = [float(p+reltarget) for p, reltarget in zip(pos, reltargets)]
+        return self.moveAsync(targets, callback, **kwargs)
+
+    def moveLatest(self, targets, **kwargs):
+        """
+        以非阻塞的方式提交目标位置，适用于交互操作与闭环反馈。
+        还未开始的目标会被更新的目标替代，正在进行的移动直接修改目标位置
+        :param targets: 目标位置
+        :param kwargs: 第一次调用时传给move的其他参数，例如timeout
+        """
+        # 不能使用_lock，否则会被正在进行的移动阻塞
+        with self._ioLock:
+            if not self.device:
+                return
+            if self._arbiter is None:
+                self._arbiter = MotionArbiter(self, **kwargs)
+            arbiter = self._arbiter
+        arbiter.submit(targets)
+
+    def getLatestHandle(self):
+        """
+        moveLatest立即返回，移动的结果(例如OutOfRange)需要从此处获得
+        :return: 最近一次结束的移动的MoveHandle，还没有结束的移动时返回None
+        """
+        arbiter = self._arbiter
+        if arbiter is None:
+            return None
+        return arbiter.lastHandle
+
+    def stopArbiter(self):
+        arbiter, self._arbiter = self._arbiter, None
+        if arbiter is not None:
+            arbiter.close()
+
+    # 停止所有轴的驱动，不需要等待正在进行的移动。实现时先增加_haltCount，使正在进行的移动以MoveHalted结束
+    @abstractmethod
+    def halt(self):
+        pass
+
+    # 移动被halt停止时抛出MoveHalted，halts为移动开始时的_haltCount
+    def _checkHalted(self, halts, targets):
+        if self._haltCount != halts:
+            raise MoveHalted('move to {} is stopped by halt()'.format(str(targets)))
+
     @abstractmethod
     def close(self):
         pass
 
+import fcre._extern.GCSSimulator as GCSSimulator
+
 try:
-    from pipython import GCSDevice, pitools
-
-    def connectPIMachine(name, mode, **kwargs):
-        """
-        连接PI设备具有三种方式
-        :param name: 控制器的名称
-        :param mode: 连接的模式，可以为RS232，USB，TCPIP
-        :param kwargs: 对应连接模式下具体的参数
-        :return: 返回目标设备对象
-        """
-        dllname = 'PI_GCS2_DLL'
-        if architecture()[0] == '64bit':
-            dllname += '_x64'
-        dllname += '.dll'
-        if dllname in os.listdir(os.getcwd()):
-            pidevice = GCSDevice(name, os.path.join(os.getcwd(), dllname))
-        else:
-            pidevice = GCSDevice(name)
-        if mode == 'RS232':
-            pidevice.ConnectRS232(comport=kwargs['comport'], baudrate=kwargs['baudrate'])
-        elif mode == 'USB':
-            pidevice.ConnectUSB(serialnum=kwargs['serialnum'])
-        elif mode == 'TCPIP':
-            pidevice.ConnectTCPIP(ipaddress=kwargs['ipaddress'])
-        else:
-            print(dedent('''
-            specify a mode "RS232", "USB", "TCPIP"
-            # pidevice.ConnectRS232(comport=1, baudrate=115200)
-            # pidevice.ConnectUSB(serialnum='123456789')
-            # pidevice.ConnectTCPIP(ipaddress='192.168.178.42')
-            '''))
-            return
+    from pipython import GCSDevice, GCSError, gcserror, pitools
+except ImportError:
+    # 没有pipython时只能连接模拟的GCS设备
+    print('Warning: No module name pipython')
+    GCSDevice = pitools = None
+    GCSError = GCSSimulator.GCSError
+    gcserror = GCSSimulator
+
+
+def connectPIMachine(name, mode, **kwargs):
+    """
+    连接PI设备具有三种方式，另外可以连接模拟的设备
+    :param name: 控制器的名称
+    :param mode: 连接的模式，可以为RS232，USB，TCPIP，SIM-模拟的设备(GCSSimulator.SimGCSDevice)
+    :param kwargs: 对应连接模式下具体的参数，SIM模式下为SimGCSDevice的参数，如numaxes，latency，velocity，tau
+    :return: 返回目标设备对象
+    """
+    if mode == 'SIM':
+        pidevice = GCSSimulator.SimGCSDevice(name, **kwargs)
         print('connected: {}'.format(pidevice.qIDN().strip()))
         return pidevice
+    if GCSDevice is None:
+        raise ImportError('pipython is required for mode {}, only mode SIM is available without it.'.format(mode))
+    dllname = 'PI_GCS2_DLL'
+    if architecture()[0] == '64bit':
+        dllname += '_x64'
+    dllname += '.dll'
+    if dllname in os.listdir(os.getcwd()):
+        pidevice = GCSDevice(name, os.path.join(os.getcwd(), dllname))
+    else:
+        pidevice = GCSDevice(name)
+    if mode == 'RS232':
+        pidevice.ConnectRS232(comport=kwargs['comport'], baudrate=kwargs['baudrate'])
+    elif mode == 'USB':
+        pidevice.ConnectUSB(serialnum=kwargs['serialnum'])
+    elif mode == 'TCPIP':
+        pidevice.ConnectTCPIP(ipaddress=kwargs['ipaddress'])
+    else:
+        print(dedent('''
+        specify a mode "RS232", "USB", "TCPIP"
+        # pidevice.ConnectRS232(comport=1, baudrate=115200)
+        # pidevice.ConnectUSB(serialnum='123456789')
+        # pidevice.ConnectTCPIP(ipaddress='192.168.178.42')
+        '''))
+        return
+    print('connected: {}'.format(pidevice.qIDN().strip()))
+    return pidevice
+
+
+class PIPZTController(PZTController):
+    """
+    PI版本的PZT控制器，继承了Controller类型。
 
-    class PIPZTController(PZTController):
-        """
-        PI版本的PZT控制器，继承了Controller类型。
+    proprety:
+        device-目标设备对象
+        _info-字典类型，保存设备对象主要信息
+        name-目标设备对象的本地名称
+        _lock-锁，保证多线程安全
 
-        proprety:
-            device-目标设备对象
-            _info-字典类型，保存设备对象主要信息
-            name-目标设备对象的本地名称
-            _lock-锁，保证多线程安全
+    method:
+        __init__-初始化
+        connect-连接PI设备
+        _init_d-初始化，获得物理设备的具体参数
+        isOpen-判断设备是否打开
+        setStartPosition-设置初始位置
+        getPosition-获得当前的位置
+        getDeviation-获得当前位置距离设备的偏移
+        move-以绝对坐标的形式移动到目标位置
+        waitontarget-等待所有轴到达目标位置
+        startRecording-配置数据记录仪，等待触发后以伺服频率记录位置
+        readRecording-一次读出数据记录仪中的数据
+        waveScan-由波形发生器以伺服频率扫描单个轴
+        close-关闭物理设备
+    """
 
-        method:
-            __init__-初始化
-            connect-连接PI设备
-            _init_d-初始化，获得物理设备的具体参数
-            isOpen-判断设备是否打开
-            setStartPosition-设置初始位置
-            getPosition-获得当前的位置
-            getDeviation-获得当前位置距离设备的偏移
-            move-以绝对坐标的形式移动到目标位置
-            close-关闭物理设备
-        """
+    def __init__(self, name, *args, **kwargs):
+        super(PIPZTController, self).__init__()
+        self.name = name
+        self._recording = None
 
-        def __init__(self, name, *args, **kwargs):
-            super(PIPZTController, self).__init__()
-            self.name = name
+    def connect(self, controllername, stages, refmode, mode, **kwargs):
+        with self._lock:
+            if self.device:
+                return
+            self._device_info.update(controllername=controllername, stages=stages, refmode=refmode, **kwargs)
+            self.device = connectPIMachine(controllername, mode, **kwargs)
+            self._init_d()
 
-        def connect(self, controllername, stages, refmode, mode, **kwargs):
-            with self._lock:
-                if self.device:
-                    return
-                self._device_info.update(controllername=controllername, stages=stages, refmode=refmode, **kwargs)
-                self.device = connectPIMachine(controllername, mode, **kwargs)
-                self._init_d()
+    # 获得基本参数
+    def _init_d(self):
+        with self._lock:
+            self.setNumaxes_d()
+            self.setRange_d()
+            self.setStartPosition()
+            self._moveState = False
+    
+    def setNumaxes_d(self):
+        with self._lock:
+            if not self.device:
+                return
+            self._info['numaxes'] = self.device.numaxes
 
-        # 获得基本参数
-        def _init_d(self):
-            with self._lock:
-                self.setNumaxes_d()
-                self.setRange_d()
-                self.setStartPosition()
-                self._moveState = False
-        
-        def setNumaxes_d(self):
-            with self._lock:
-                if not self.device:
-                    return
-                self._info['numaxes'] = self.device.numaxes
+    def setRange_d(self):
+        with self._lock:
+            if not self.device:
+                return
+            rangemin = list(self.device.qTMN().values())
+            print('min range for each axis is: {}'.format(str(rangemin)))
+            rangemax = list(self.device.qTMX().values())
+            print('max range for each axis is: {}'.format(str(rangemax)))
+            # 总行程
+            self._info['range'] = tuple(zip(rangemin, rangemax))
+
+    # PI运行时需要初始扫描参考点
+    def startup(self):
+        with self._lock:
+            if not self.device:
+                return
+            if isinstance(self.device, GCSSimulator.SimGCSDevice):
+                # 模拟的设备不需要扫描参考点
+                return
+            print('initialize connected stages...')
+            pitools.startup(self.device, stages=self._device_info['stages'], 
+                    refmode=self._device_info['refmode'])            
 
-        def setRange_d(self):
-            with self._lock:
-                if not self.device:
-                    return
-                rangemin = list(self.device.qTMN().values())
-                print('min range for each axis is: {}'.format(str(rangemin)))
-                rangemax = list(self.device.qTMX().values())
-                print('max range for each axis is: {}'.format(str(rangemax)))
-                # 总行程
-                self._info['range'] = tuple(zip(rangemin, rangemax))
+    def getPosition(self):
+        with self._ioLock:
+            if not self.device:
+                return
+            r = self.device.qPOS(self.device.axes)
+            rt = []
+            for i in range(self._info['numaxes']):
+                rt.append(r[str(i + 1)])
+            return tuple(rt)
+
+    def _sample_d(self):
+        with self._ioLock:
+            if not self.device:
+                return
+            axes = self.device.axes
+            pos = self.device.qPOS(axes)
+            ont = self.device.qONT(axes)
+            return (tuple(pos[axis] for axis in axes),
+                    tuple(not ont[axis] for axis in axes),
+                    None)
+
+    def move(self, targets, timeout=60, handle=None):
+        with self._lock:
+            targets = self._checkTargets(targets)
+            self._move(range(self._info['numaxes']), targets, timeout, handle)
 
-        # PI运行时需要初始扫描参考点
-        def startup(self):
-            with self._lock:
-                if not self.device:
-                    return
-                print('initialize connected stages...')
-                pitools.startup(self.device, stages=self._device_info['stages'], 
-                        refmode=self._device_info['refmode'])            
+    def moveAxis(self, axis, target, timeout=60, handle=None):
+        with self._lock:
+            target = self._checkAxisTarget(axis, target)
+            self._move([axis], [target], timeout, handle)
 
-        def getPosition(self):
-            with self._lock:
+    # 只对indices中的轴发出MOV并等待
+    def _move(self, indices, targets, timeout, handle):
+        with self._lock:
+            try:
+                self._moveState = True
                 if not self.device:
+                    raise SystemError('No available device.')
+                print('{} targets: {}'.format(str(self.name), str(targets)))
+                axes = [self.device.axes[i] for i in indices]
+                halts = self._haltCount
+                with self._ioLock:
+                    self.device.MOV(axes, targets)
+                self.waitontarget(targets, timeout=timeout, handle=handle, axes=axes)
+                self._checkHalted(halts, targets)
+                self._moveState = False
+            except SystemError:
+                self._moveState = None
+                self.close()
+                raise
+            except MoveHalted:
+                # 已经由halt停止
+                self._moveState = False
+                raise
+            except MoveCancelled:
+                # 只停止这次移动的轴
+                self._stopAxes([self.device.axes[i] for i in indices])
+                self._moveState = False
+                raise
+            except:
+                self._moveState = False
+                raise
+
+    def waitontarget(self, targets, timeout=60, polldelay=None, handle=None, axes=None):
+        """
+        等待轴到达目标位置，与pitools.waitontarget相同，
+        但默认由AdaptivePoll根据预测的到达时间决定轮询间隔
+        :param targets: 各轴的目标位置，与axes对应
+        :param timeout: 超时时间，单位s
+        :param polldelay: 轮询间隔，单位s，默认为None
+        :param handle: MoveHandle对象，每次轮询时报告进度，被取消时抛出MoveCancelled，
+                       修改目标位置时重新发出MOV
+        :param axes: 需要等待的轴的名称，默认为None，即所有轴
+        """
+        # 只在每次查询时持有_ioLock，等待过程中其他线程可以查询状态
+        with self._lock:
+            if axes is None:
+                axes = self.device.axes
+            targets = dict(zip(axes, targets))
+            maxtime = time.time() + timeout
+            poll = AdaptivePoll()
+            while True:
+                with self._ioLock:
+                    ont = self.device.qONT(axes)
+                    active = [axis for axis in axes if not ont[axis]]
+                    if handle is not None or (active and polldelay is None):
+                        pos = self.device.qPOS(axes)
+                if handle is not None:
+                    newtargets = handle._progress(tuple(pos[axis] for axis in axes))
+                    if newtargets is not None:
+                        with self._ioLock:
+                            self.device.MOV(axes, list(newtargets))
+                        targets = dict(zip(axes, newtargets))
+                        maxtime = time.time() + timeout
+                        poll = AdaptivePoll()
+                        continue
+                if not active:
                     return
-                r = self.device.qPOS(self.device.axes)
-                rt = []
-                for i in range(self._info['numaxes']):
-                    rt.append(r[str(i + 1)])
-                return tuple(rt)
+                now = time.time()
+                if now > maxtime:
+                    raise SystemError('waitontarget() timed out after %.1f seconds' % timeout)
+                if polldelay is None:
+                    pos = {axis: pos[axis] for axis in active}
+                    distances = {axis: abs(targets[axis] - pos[axis]) for axis in active}
+                    time.sleep(poll.next(now, pos, distances))
+                else:
+                    time.sleep(polldelay)
 
-        def move(self, targets, timeout=60):
-            with self._lock:
-                if len(targets) != self._info['numaxes']:
-                    raise TypeError('The number of axes set is not equal to the' 
-                                    'number of axes of the device.')
-                try:
-                    self._moveState = True
-                    if not self.device:
-                        raise SystemError('No available device.')
-                    for i in self.device.axes:
-                        i = int(i) - 1
-                        _range = self._info['range'][i]
-                        if (targets[i] > _range[1]) or (targets[i] < _range[0]):
-                            raise OutOfRange('Sorry, out of range in axis {}'.format(str(i)))
-                    print('{} targets: {}'.format(str(self.name), str(targets)))
-                    self.device.MOV(self.device.axes, targets)
-                    pitools.waitontarget(self.device, timeout=timeout)
-                    self._moveState = False
-                except SystemError:
-                    self._moveState = None
-                    self.close()
-                    raise
-                except:
-                    self._moveState = False
+    def startRecording(self, axes=None, rate=1, trigger=2):
+        """
+        配置数据记录仪，每个轴占用两个记录表，分别记录实际位置与目标位置。
+        例如trigger为2时，调用move后开始记录，结束后由readRecording读出
+        :param axes: 需要记录的轴的序号，默认为None即所有轴
+        :param rate: 记录间隔，单位为伺服周期(RTR)
+        :param trigger: 触发源(DRT)，1为任何改变位置的命令，2为下一个命令
+        """
+        with self._ioLock:
+            if not self.device:
+                return
+            if axes is None:
+                axes = range(self._info['numaxes'])
+            names = [self.device.axes[i] for i in axes]
+            tables = list(range(1, 2 * len(names) + 1))
+            if len(tables) > self.device.qTNR():
+                raise TypeError('The number of axes is more than the data recorder tables can record.')
+            for k, name in enumerate(names):
+                self.device.DRC(tables[2*k], name, 2)  # 实际位置
+                self.device.DRC(tables[2*k+1], name, 1)  # 目标位置
+            self.device.RTR(rate)
+            self.device.DRT(0, trigger, '0')
+            self._recording = {'axes': tuple(axes), 'tables': tables}
+
+    def readRecording(self, numvalues=None, offset=1, timeout=60):
+        """
+        :param numvalues: 读出的点数，默认为None即已经记录的所有点
+        :param offset: 第一个点的序号，从1开始
+        :param timeout: 读取的超时时间，单位s
+        :return: (t, data)，t为时间，单位s，data形状为(点数, 轴数, 2)，最后一维为实际位置与目标位置
+        """
+        with self._ioLock:
+            if not self.device:
+                return
+            if self._recording is None:
+                raise TypeError('The data recorder is not configured, call startRecording first.')
+            tables = self._recording['tables']
+            if numvalues is None:
+                numvalues = min(self.device.qDRL(tables).values())
+            header = self.device.qDRR(tables, offset, numvalues)
+            # 数据在后台线程中读取
+            maxtime = time.time() + timeout
+            while self.device.bufstate is not True:
+                if time.time() > maxtime:
+                    raise SystemError('readRecording() timed out after %.1f seconds' % timeout)
+                time.sleep(0.05)
+            data = np.array(self.device.bufdata, dtype=float)
+        t = (np.arange(data.shape[1]) + offset - 1) * float(header['SAMPLE_TIME'])
+        return t, data.T.reshape(data.shape[1], -1, 2)
+
+    def waveScan(self, axis, wave='line', amplitude=0, offset=None, numpoints=1000, points=None,
+                 cycles=1, rate=1, trigger=None, timeout=60):
+        """
+        将波形写入波形发生器并运行，波形运行完毕后返回。扫描由控制器以伺服频率完成，不需要逐点通信
+        :param axis: 轴的序号
+        :param wave: 'line'-直线(WAV_LIN)，'triangle'-三角波(WAV_RAMP)，'points'-自定义的点(WAV_PNT)
+        :param amplitude: 直线与三角波的幅值
+        :param offset: 波形的起点，默认为None即当前位置
+        :param numpoints: 直线与三角波的点数
+        :param points: 自定义的点，wave为'points'时使用
+        :param cycles: 运行的周期数
+        :param rate: 每个点的伺服周期数(WTR)
+        :param trigger: 字典，line为触发输出的通道，points为需要输出触发信号的点，
+                        用于与相机同步，默认为None即不输出
+        :param timeout: 超时时间，单位s
+        :return: 已经运行的周期数(qWGN)
+        """
+        with self._lock:
+            if not self.device:
+                return
+            if offset is None:
+                offset = self.getPosition()[axis]
+            if wave == 'points':
+                points = [float(p) for p in points]
+                numpoints = len(points)
+                extent = (min(points), max(points))
+            elif wave in ('line', 'triangle'):
+                extent = (offset, offset + amplitude)
+            else:
+                raise ValueError('Unknown wave: {}'.format(wave))
+            for target in extent:
+                self._checkAxisTarget(axis, target)
+
+            wavegen = table = axis + 1
+            with self._ioLock:
+                if wave == 'line':
+                    self.device.WAV_LIN(table, 0, numpoints, 'X', numpoints // 10, amplitude, offset, numpoints)
+                elif wave == 'triangle':
+                    self.device.WAV_RAMP(table, 0, numpoints, 'X', numpoints // 2, numpoints // 10,
+                                         amplitude, offset, numpoints)
+                else:
+                    # 点数较多时分段写入
+                    for begin in range(0, numpoints, 100):
+                        chunk = points[begin:begin+100]
+                        self.device.WAV_PNT(table, begin, len(chunk), 'X' if begin == 0 else '&', chunk)
+                self.device.WSL(wavegen, table)
+                self.device.WGC(wavegen, cycles)
+                self.device.WTR(wavegen, rate, 0)
+                if trigger is not None:
+                    line = trigger.get('line', 1)
+                    tpoints = list(trigger['points'])
+                    self.device.TWC()
+                    self.device.TWS([line] * len(tpoints), tpoints, [1] * len(tpoints))
+                    self.device.CTO(line, 3, 4)  # 触发模式为波形发生器
+
+            # 先移动到波形的起点
+            self.moveAxis(axis, points[0] if wave == 'points' else offset)
+            try:
+                self._moveState = True
+                with self._ioLock:
+                    self.device.WGO(wavegen, 1)
+                maxtime = time.time() + timeout
+                while True:
+                    with self._ioLock:
+                        running = self.device.IsGeneratorRunning(wavegen)[wavegen]
+                    if not running:
+                        break
+                    if time.time() > maxtime:
+                        raise SystemError('waveScan() timed out after %.1f seconds' % timeout)
+                    time.sleep(0.05)
+                with self._ioLock:
+                    return self.device.qWGN(wavegen)[wavegen]
+            finally:
+                with self._ioLock:
+                    self.device.WGO(wavegen, 0)
+                self._moveState = False
+
+    # 只需要_ioLock，移动过程中也可以立即停止
+    def _stopAxes(self, axes):
+        with self._ioLock:
+            if not self.device:
+                return
+            try:
+                self.device.HLT(axes)
+            except GCSError as e:
+                # HLT总是设置错误码10，表示运动被停止
+                if e.val != gcserror.E10_PI_CNTR_STOP:
                     raise
 
-        def close(self):
-            with self._lock:
-                if not self.device:
-                    return
-                try:
-                    self.device.close()
-                except Exception as e:
-                    print(str(e))
-                finally:
-                    self.device = None
-                    self._device_info.clear()
+    def halt(self):
+        # 紧急停止，STP同时停止所有轴以及波形发生器，HLT只会减速停止轴的运动
+        with self._ioLock:
+            if not self.device:
+                return
+            self._haltCount += 1
+            try:
+                self.device.STP()
+            except GCSError as e:
+                # 与HLT相同，STP设置错误码10
+                if e.val != gcserror.E10_PI_CNTR_STOP:
+                    raise
 
-        def __del__(self):
-            print('关闭PI压电:{}'.format(self.name))
-            self.close()
+    def close(self):
+        self.stopSampler()
+        self.stopArbiter()
+        with self._lock, self._ioLock:
+            if not self.device:
+                return
+            try:
+                self.device.close()
+            except Exception as e:
+                print(str(e))
+            finally:
+                self.device = None
+                self._device_info.clear()
+
+    def __del__(self):
+        print('关闭PI压电:{}'.format(self.name))
+        self.close()
 
-except ImportError:
-    print('Warning: No module name pipython')
-    PIPZTController = None
 
 try:
     import fcre._extern.AMC as AMC
@@ -363,56 +1140,200 @@ try:
 
         @staticmethod
         def waitontarget(device, axis, timeout=60, eottimeout=1):
+            return amctools.waitontargetAll(device, [axis], timeout, eottimeout)[0]
+
+        @staticmethod
+        def profileCalls(profile, axis, phase):
+            """
+            :param profile: 字典，window为精细逼近的范围，coarse与fine为(amplitude, frequency)，单位mV与mHz
+            :param phase: 'coarse'或'fine'
+            :return: 设置驱动幅值与频率的批处理请求
+            """
+            amplitude, frequency = profile[phase]
+            return [('setAmplitude', [axis, int(amplitude)]), ('setFrequency', [axis, int(frequency)])]
+
+        @staticmethod
+        def profilePhase(profile, distance):
+            return 'fine' if abs(distance) <= profile['window'] else 'coarse'
+
+        @staticmethod
+        def waitontargetAll(device, axes, timeout=60, eottimeout=1, polldelay=None, handle=None, profiles=None):
+            """
+            同时等待多个轴到达目标位置。每次轮询只发出一次批处理请求，
+            某个轴到达目标位置或者行程末端时立即停止该轴的驱动，不需要等待其他轴。
+            :param device: AMC.AMCClient对象
+            :param axes: 需要等待的轴
+            :param timeout: 超时时间，单位s
+            :param eottimeout: 位置在此时间内没有变化时认为到达行程末端，单位s
+            :param polldelay: 轮询间隔，单位s，默认为None，即由AdaptivePoll根据预测的到达时间决定
+            :param handle: MoveHandle对象，每次轮询时报告进度，被取消时抛出MoveCancelled，
+                           修改目标位置(按axes的顺序)时重新设置所有轴的目标位置与驱动
+            :param profiles: 字典，轴对应的驱动参数(参考profileCalls)，距离进入window时切换为精细逼近，
+                             默认为None即不改变驱动参数。调用前需要按照当前的距离设置好驱动参数
+            :return: 列表，与axes对应，True表示到达目标位置，False表示到达行程末端
+            """
+            axes = list(axes)
+            n = len(axes)
             maxtime = time.time() + timeout
-            target_range = AMC.getTargetRange(device, axis)[1]
-            target_pos = AMC.getTargetPosition(device, axis)[1]
+            results = device.batch([('getTargetRange', [axis]) for axis in axes] +
+                                   [('getTargetPosition', [axis]) for axis in axes] +
+                                   [('getPosition', [axis]) for axis in axes])
+            target_range = dict(zip(axes, results[:n]))
+            target_pos = dict(zip(axes, results[n:2*n]))
 
             # eot detection
-            max_interval = int(eottimeout/0.1) + 1
-            last_pos = AMC.getPosition(device, axis)[1]
-            i_interval = 0
+            last_pos = dict(zip(axes, results[2*n:]))
+            current = dict(last_pos)
+            last_time = dict.fromkeys(axes, time.time())
 
+            profiles = profiles or {}
+            phase = {axis: amctools.profilePhase(profiles[axis], target_pos[axis] - current[axis])
+                     for axis in axes if axis in profiles}
+
+            poll = AdaptivePoll()
+            states = {}
             while True:
-                errno, status = AMC.getStatusMoving(device, axis)
-                if errno:
+                active = [axis for axis in axes if axis not in states]
+                m = len(active)
+                # 所有未到达的轴的状态、位置以及EOT状态以一次批处理请求获得
+                try:
+                    results = device.batch([('getStatusMoving', [axis]) for axis in active] +
+                                           [('getPosition', [axis]) for axis in active] +
+                                           [('getStatusEotFwd', [axis]) for axis in active] +
+                                           [('getStatusEotBkwd', [axis]) for axis in active])
+                except AMC.AMCError:
                     raise SystemError('System error! Please reconnect the device.')
+                now = time.time()
+
+                stops = []
+                switches = []
+                positions = {}
+                for k, axis in enumerate(active):
+                    status, pos, eotfwd, eotbkwd = results[k], results[m+k], results[2*m+k], results[3*m+k]
+                    if status != 1: # status == 1 for moving status
+                        states[axis] = True
+                    elif abs(pos - target_pos[axis]) < target_range[axis]:
+                        states[axis] = True
+                        stops.append(axis)
+                    elif (eotfwd and target_pos[axis] > pos) or (eotbkwd and target_pos[axis] < pos):
+                        states[axis] = False
+                        stops.append(axis)
+                    elif now - last_time[axis] >= eottimeout:
+                        # no-blocking End of Travel detection
+                        if abs(last_pos[axis] - pos) < target_range[axis]:
+                            states[axis] = False
+                            stops.append(axis)
+                        last_pos[axis] = pos
+                        last_time[axis] = now
+                    if axis not in states:
+                        positions[axis] = pos
+                        if axis in profiles:
+                            p = amctools.profilePhase(profiles[axis], target_pos[axis] - pos)
+                            if p != phase[axis]:
+                                phase[axis] = p
+                                switches += amctools.profileCalls(profiles[axis], axis, p)
+                    current[axis] = pos
+                if stops or switches:
+                    device.batch([('setMove', [axis, False]) for axis in stops] + switches)
+                if handle is not None:
+                    newtargets = handle._progress(tuple(current[axis] for axis in axes))
+                    if newtargets is not None:
+                        target_pos = dict(zip(axes, newtargets))
+                        calls = []
+                        for axis in axes:
+                            calls.append(('setTargetPosition', [axis, target_pos[axis]]))
+                            calls.append(('setMove', [axis, True]))
+                        device.batch(calls)
+                        states.clear()
+                        last_pos = dict(current)
+                        last_time = dict.fromkeys(axes, now)
+                        maxtime = now + timeout
+                        poll = AdaptivePoll()
+                        continue
+
+                if len(states) == n:
+                    return [states[axis] for axis in axes]
+                if now > maxtime:
+                    raise SystemError('waitontarget() timed out after %.1f seconds' % timeout)
+                if polldelay is None:
+                    distances = {axis: abs(target_pos[axis] - pos) - target_range[axis]
+                                 for axis, pos in positions.items()}
+                    time.sleep(poll.next(now, positions, distances))
+                else:
+                    time.sleep(polldelay)
 
-                if status == 1: # status == 1 for moving status
-
-                    pos = AMC.getPosition(device, axis)[1]
-                    if abs(pos - target_pos) < target_range:
-                        AMC.setMove(device, axis, False)
-                        break
-
-                    # no-blocking End of Travel detection
-                    if i_interval != max_interval:
-                        i_interval += 1
-                    else:
-                        i_interval = 0
-                        
-                        pos = AMC.getPosition(device, axis)[1]
-                        if abs(last_pos - pos) < target_range:
-                            AMC.setMove(device, axis, False)
-                            return False
-                        last_pos = pos
 
-                    if time.time() > maxtime:
-                        raise SystemError('waitontarget() timed out after %.1f seconds' % timeout)
-                    time.sleep(0.1)
-                else:
-                    break
-            
-            return True
+        @staticmethod
+        def findEot(device, axes, forward, timeout=60, eottimeout=1, polldelay=0.02):
+            """
+            以连续移动的方式同时将多个轴驱动到行程末端
+            :param device: AMC.AMCClient对象
+            :param axes: 需要驱动的轴
+            :param forward: True为正向，False为反向
+            :param timeout: 超时时间，单位s
+            :param eottimeout: 位置在此时间内没有变化时认为到达行程末端，单位s
+            :param polldelay: 轮询间隔，单位s
+            :return: 字典，各轴到达行程末端时的位置
+            """
+            axes = list(axes)
+            n = len(axes)
+            continuous = 'setContinuousFwd' if forward else 'setContinuousBkwd'
+            eotstatus = 'getStatusEotFwd' if forward else 'getStatusEotBkwd'
+            maxtime = time.time() + timeout
+            results = device.batch([('getTargetRange', [axis]) for axis in axes] +
+                                   [('getPosition', [axis]) for axis in axes])
+            target_range = dict(zip(axes, results[:n]))
+            last_pos = dict(zip(axes, results[n:]))
+            last_time = dict.fromkeys(axes, time.time())
+
+            ends = {}
+            device.batch([(continuous, [axis, True]) for axis in axes])
+            try:
+                while True:
+                    active = [axis for axis in axes if axis not in ends]
+                    m = len(active)
+                    try:
+                        results = device.batch([(eotstatus, [axis]) for axis in active] +
+                                               [('getPosition', [axis]) for axis in active])
+                    except AMC.AMCError:
+                        raise SystemError('System error! Please reconnect the device.')
+                    now = time.time()
+                    stops = []
+                    for k, axis in enumerate(active):
+                        eot, pos = results[k], results[m+k]
+                        if eot:
+                            ends[axis] = pos
+                            stops.append(axis)
+                        elif now - last_time[axis] >= eottimeout:
+                            if abs(last_pos[axis] - pos) < target_range[axis]:
+                                ends[axis] = pos
+                                stops.append(axis)
+                            last_pos[axis] = pos
+                            last_time[axis] = now
+                    if stops:
+                        device.batch([(continuous, [axis, False]) for axis in stops])
+                    if len(ends) == n:
+                        return ends
+                    if now > maxtime:
+                        raise SystemError('findEot() timed out after %.1f seconds' % timeout)
+                    time.sleep(polldelay)
+            finally:
+                device.batch([(continuous, [axis, False]) for axis in axes])
 
 
     class AMCPZTController(PZTController):
         """
         AMC版本的PZT控制器，继承了Controller类型。
+        测得的行程以序列号为键保存在rangeFile中，连接时自动导入。
 
         proprety:
             device-目标设备对象
             _info-字典类型，保存设备对象主要信息
             name-目标设备对象的本地名称
+            rangeFile-保存行程的JSON文件，默认在用户目录的.fcre文件夹中，与启动程序的目录无关
+            _profiles-字典，各轴的驱动参数，距离大于window时使用coarse，否则使用fine
+            _speeds-字典，autotuneProfile测得的各轴在不同频率下的速度，单位nm/s
+            _rtin-字典，由外部信号驱动的轴的配置，这些轴不能通过move移动
             _lock-锁，保证多线程安全
 
         method:
@@ -422,21 +1343,44 @@ try:
             isOpen-判断设备是否打开
             setStartPosition-设置初始位置
             getPosition-获得当前的位置
+            getStatus-以一次批处理请求获得所有轴的位置与移动状态
             getDeviation-获得当前位置距离设备的偏移
             move-以绝对坐标的形式移动到目标位置
+            setProfile-设置与距离相关的驱动参数
+            getProfile-获得驱动参数
+            autotuneProfile-测量速度与驱动频率的关系，并设置驱动参数
+            armRealTimeIn-配置轴由外部GPIO/AQuadB信号驱动
+            disarmRealTimeIn-取消外部信号驱动
+            getRealTimeIn-获得外部信号驱动的配置
+            discoverRange-连续移动到两端的行程末端，测量行程
+            saveRange-保存行程到rangeFile
+            loadRange-从rangeFile中导入行程
             close-关闭物理设备
         """
+        rangeFile = os.path.join(os.path.expanduser('~'), '.fcre', 'amcrange.json')
+        _rangeFileLock = threading.Lock()
+        # 实时输入的模式，参考AMC.setRealTimeInMode
+        RTIN_MODES = {'aquadb': 0, 'aquadb-lvds': 1, 'stepper': 8, 'stepper-lvds': 9,
+                      'trigger': 10, 'trigger-lvds': 11, 'disable': 15}
 
         def __init__(self, name, *args, **kwargs):
             super(AMCPZTController, self).__init__()
             self.name = name
+            self._profiles = {}
+            self._speeds = {}
+            self._rtin = {}
 
-        def connect(self, ip='192.168.1.1', *args, **kwargs):
+        def connect(self, ip='192.168.1.1', *args, port=AMC.TCP_PORT, **kwargs):
             with self._lock:
                 if self.device:
                     return
-                self._device_info.update(ip=ip)
-                self.device = AMC.connect(ip)
+                self._device_info.update(ip=ip, port=port)
+                self.device = AMC.AMCClient(ip, port)
+                # 不同的固件返回'SN'或者(errorNumber, 'SN')
+                serial = self.device.getSN()
+                if isinstance(serial, (list, tuple)):
+                    serial = serial[-1]
+                self._device_info['serial'] = str(serial)
                 self._init_d()
 
         def _init_d(self):
@@ -450,22 +1394,28 @@ try:
             with self._lock:
                 if not self.device:
                     return
-                for i in range(3):  # AMC can only control axis [0..2]
-                    if AMC.setOutput(self.device, i, True) != 0:
+                # AMC can only control axis [0..2]
+                results = self.device.batch([('setOutput', [i, True]) for i in range(3)], check=False)
+                numaxes = 0
+                for result in results:
+                    if result[0] != 0:
                         break
-                    else:
-                        AMC.setMove(self.device, i, False)
-                self._info['numaxes'] = i
+                    numaxes += 1
+                self.device.batch([('setMove', [i, False]) for i in range(numaxes)])
+                self._info['numaxes'] = numaxes
 
         def setRange_d(self):
             with self._lock:
                 if not self.device:
                     return
-                t_range = []
                 # End of Travel detection
-                for i in range(self._info['numaxes']):
-                    AMC.setEotOutputDeactive(self.device, i, True)
-                    t_range.append((None,None))
+                self.device.batch([('setEotOutputDeactive', [i, True]) for i in range(self._info['numaxes'])])
+                t_range = [(None, None)] * self._info['numaxes']
+                saved = self.loadRange()
+                if saved:
+                    for i, _range in enumerate(saved[:self._info['numaxes']]):
+                        t_range[i] = tuple(_range)
+                    print('load range: {}'.format(str(t_range)))
 
                 # 总行程
                 self._info['range'] = tuple(t_range)
@@ -477,60 +1427,101 @@ try:
                 self.setRange_d()
 
         def getPosition(self):
+            # 不需要锁，AMCClient可以在多个线程中同时使用
+            device = self.device
+            if not device:
+                return
+            # 所有轴的位置以一次批处理请求获得
+            pos = device.batch([('getPosition', [i]) for i in range(self._info['numaxes'])])
+            self._info['position'] = pos
+            return tuple(pos)
+
+        def getStatus(self):
+            """
+            以一次批处理请求获得所有轴的位置与移动状态
+            :return: 字典，position为各轴位置，moving为各轴的移动状态(0: idle, 1: moving, 2: pending)
+            """
+            device = self.device
+            if not device:
+                return
+            numaxes = self._info['numaxes']
+            results = device.batch([('getPosition', [i]) for i in range(numaxes)] +
+                                   [('getStatusMoving', [i]) for i in range(numaxes)])
+            pos = results[:numaxes]
+            self._info['position'] = pos
+            return {'position': tuple(pos),
+                    'moving': tuple(results[numaxes:])}
+
+        def _sample_d(self):
+            # 不需要锁，AMCClient可以在多个线程中同时使用，采样不会被移动阻塞
+            device = self.device
+            if not device:
+                return
+            numaxes = self._info['numaxes']
+            calls = []
+            for name in ('getPosition', 'getStatusMoving', 'getStatusEotFwd', 'getStatusEotBkwd'):
+                calls += [(name, [i]) for i in range(numaxes)]
+            results = device.batch(calls)
+            pos, moving, fwd, bkwd = (results[k*numaxes:(k+1)*numaxes] for k in range(4))
+            return tuple(pos), tuple(moving), tuple(zip(fwd, bkwd))
+
+        def move(self, targets, timeout=60, eottimeout=1, handle=None):
             with self._lock:
-                if not self.device:
-                    return
-                pos = [AMC.getPosition(self.device, i)[1] for i in range(self._info['numaxes'])]
-                self._info['position'] = pos
-                return tuple(pos)
+                # out of range judgement
+                targets = self._checkTargets(targets)
+                self._move(range(self._info['numaxes']), targets, timeout, eottimeout, handle)
 
-        def move(self, targets, timeout=60, eottimeout=1):
+        def moveAxis(self, axis, target, timeout=60, eottimeout=1, handle=None):
+            with self._lock:
+                target = self._checkAxisTarget(axis, target)
+                self._move([axis], [target], timeout, eottimeout, handle)
+
+        # 只对indices中的轴设置目标位置与驱动并等待
+        def _move(self, indices, targets, timeout, eottimeout, handle):
             with self._lock:
-                if len(targets) != self._info['numaxes']:
-                    raise TypeError('The number of axes set is not equal to the' 
-                                    'number of axes of the device.')
                 try:
                     self._moveState = True
                     if not self.device:
                         raise SystemError('No available device.')
 
-                    # out of range judgement
-                    targets = [int(t) for t in targets]
-                    for i in range(self._info['numaxes']):
-                        _range = self._info['range'][i]
-                        if (None not in _range):
-                            if (targets[i] > _range[1]) or (targets[i] < _range[0]):
-                                raise OutOfRange('Sorry, out of range in axis {}'.format(str(i)))
-                        else:
-                            continue
-                    
                     #　move to targets
                     print('{} targets: {}'.format(str(self.name), str(targets)))
-                    for i, target in enumerate(targets):
-                        AMC.setTargetPosition(self.device, i, target)
-                        AMC.setMove(self.device, i, True)
+                    profiles = {i: self._profiles[i] for i in indices if i in self._profiles}
+                    if profiles:
+                        start = dict(zip(profiles, self.device.batch([('getPosition', [i]) for i in profiles])))
+                    calls = []
+                    for i, target in zip(indices, targets):
+                        if i in profiles:
+                            phase = amctools.profilePhase(profiles[i], target - start[i])
+                            calls += amctools.profileCalls(profiles[i], i, phase)
+                        calls.append(('setTargetPosition', [i, target]))
+                        calls.append(('setMove', [i, True]))
+                    halts = self._haltCount
+                    self.device.batch(calls)
                     
                     # wait
-                    states = [None] * self._info['numaxes']
-                    for i in range(self._info['numaxes']):
-                        states[i] = amctools.waitontarget(self.device, i, timeout, eottimeout)
+                    states = amctools.waitontargetAll(self.device, indices, timeout, eottimeout, handle=handle,
+                                                      profiles=profiles)
+                    # halt后驱动停止，轴不再处于移动状态，不能当作到达目标位置或者行程末端
+                    self._checkHalted(halts, targets)
                     self._moveState = False
                     
                     # update range!
                     if not all(states):
                         err_info = "" 
-                        for i, state in enumerate(states):
+                        for i, target, state in zip(indices, targets, states):
                             if not state:
-                                pos = AMC.getPosition(self.device, i)[1]
+                                pos = self.device.getPosition(i)
                                 _range = list(self._info['range'][i])
-                                if pos < targets[i]:
+                                if pos < target:
                                     _range[1] = pos
                                 else:
                                     _range[0] = pos
-                                self._info['range'][i] = tuple(_range)
+                                self._setAxisRange(i, _range)
                                 print('range for axis {} is: {}'.format(str(i), str(_range)))
                                 err_info += 'Sorry, out of range in axis {}. ' \
                                         'Position {} Range {}\n'.format(str(i), str(pos), str(_range))
+                        self.saveRange()
                         raise OutOfRange(err_info)
 
                 except SystemError:
@@ -538,30 +1529,771 @@ try:
                     self.close()
                     raise
                 except:
-                    for i in range(self._info['numaxes']):
-                        AMC.setMove(self.device, i, False)
+                    self.device.batch([('setMove', [i, False]) for i in indices])
+                    self._moveState = False
+                    raise
+
+        def _checkAxisTarget(self, axis, target):
+            if axis in self._rtin:
+                raise RuntimeError('Axis {} is driven by real time input, disarm it first.'.format(str(axis)))
+            return super(AMCPZTController, self)._checkAxisTarget(axis, int(target))
+
+        def armRealTimeIn(self, axis, mode='stepper', stepsPerPulse=1, changePerPulse=None):
+            """
+            配置轴由外部GPIO/AQuadB信号驱动，此后每一步不再需要网络请求
+            :param axis: 轴的序号
+            :param mode: RTIN_MODES中的名称或者对应的数值
+            :param stepsPerPulse: 开环模式下每个脉冲移动的步数
+            :param changePerPulse: 不为None时使用闭环模式，每个脉冲改变目标位置changePerPulse，单位nm
+            """
+            with self._lock:
+                if not self.device:
+                    return
+                mode = self.RTIN_MODES.get(mode, mode)
+                loop = changePerPulse is not None
+                calls = [('setRealTimeInMode', [axis, mode]),
+                         ('setRealTimeInFeedbackLoopMode', [axis, int(loop)])]
+                if loop:
+                    calls.append(('setRealtimeInputChangePerPulse', [axis, int(changePerPulse)]))
+                else:
+                    calls.append(('setRealtimeInputStepsPerPulse', [axis, int(stepsPerPulse)]))
+                calls.append(('setRealtimeInputMove', [axis, True]))
+                calls.append(('applyRealTimeIn', [axis]))
+                self.device.batch(calls)
+                self._rtin[axis] = {'mode': mode, 'loop': loop, 'stepsPerPulse': stepsPerPulse,
+                                    'changePerPulse': changePerPulse}
+
+        def disarmRealTimeIn(self, axis=None):
+            """
+            :param axis: 轴的序号，默认为None即所有由外部信号驱动的轴
+            """
+            with self._lock:
+                axes = list(self._rtin) if axis is None else [axis]
+                if not self.device or not axes:
+                    return
+                calls = []
+                for i in axes:
+                    calls.append(('setRealtimeInputMove', [i, False]))
+                    calls.append(('setRealTimeInMode', [i, self.RTIN_MODES['disable']]))
+                    calls.append(('applyRealTimeIn', [i]))
+                    self._rtin.pop(i, None)
+                self.device.batch(calls)
+
+        def getRealTimeIn(self):
+            return copy.deepcopy(self._rtin)
+
+        def setProfile(self, coarse=None, fine=None, window=None, axes=None):
+            """
+            设置与距离相关的驱动参数：距离目标大于window时以coarse快速逼近，进入window后切换为fine精细逼近
+            :param coarse: (amplitude, frequency)，单位mV与mHz，为None时取消驱动参数，使用设备当前的设置
+            :param fine: (amplitude, frequency)
+            :param window: 精细逼近的范围，单位nm
+            :param axes: 需要设置的轴，默认为None即所有轴
+            """
+            if axes is None:
+                axes = range(self._info['numaxes'])
+            profile = None
+            if coarse is not None:
+                if fine is None or window is None:
+                    raise ValueError('fine and window must be given together with coarse.')
+                profile = {'coarse': tuple(coarse), 'fine': tuple(fine), 'window': window}
+                for phase in ('coarse', 'fine'):
+                    if len(profile[phase]) != 2:
+                        raise ValueError('{} must be (amplitude, frequency).'.format(phase))
+                if window < 0:
+                    raise ValueError('window must not be negative.')
+            for axis in axes:
+                if profile is None:
+                    self._profiles.pop(axis, None)
+                else:
+                    self._profiles[axis] = dict(profile)
+
+        def getProfile(self):
+            return copy.deepcopy(self._profiles)
+
+        def autotuneProfile(self, axes=None, frequencies=(100000, 200000, 500000, 1000000, 2000000, 5000000),
+                            amplitude=None, duration=0.2, reaction=0.01, finetime=0.1, apply=True):
+            """
+            在不同的驱动频率下连续移动，测量速度，并以此设置驱动参数：coarse为速度最快的频率，
+            window为coarse速度下reaction时间内移动的距离(即切换前可能越过的距离)，
+            fine为能在finetime内走完window的最低频率
+            :param axes: 需要测量的轴，默认为None即所有轴
+            :param frequencies: 测量的频率，单位mHz
+            :param amplitude: 驱动幅值，单位mV，默认为None即设备当前的幅值
+            :param duration: 每个频率每个方向连续移动的时间，单位s。每个频率先正向再反向各移动一次，
+                             速度取两次的平均值，到达行程末端的一次不计入。测量结束后返回原来的位置
+            :param reaction: 切换为精细逼近所留的时间，单位s
+            :param finetime: 精细逼近的最长时间，单位s
+            :param apply: 是否设置驱动参数
+            :return: 字典，各轴在不同频率下的速度，单位nm/s，所有测量都到达行程末端的频率不包含在内
+            """
+            with self._lock:
+                if not self.device:
+                    return
+                if axes is None:
+                    axes = list(range(self._info['numaxes']))
+                n = len(axes)
+                results = self.device.batch([('getAmplitude', [axis]) for axis in axes] +
+                                            [('getFrequency', [axis]) for axis in axes] +
+                                            [('getPosition', [axis]) for axis in axes])
+                originalAmplitudes = dict(zip(axes, results[:n]))
+                originalFrequencies = dict(zip(axes, results[n:2*n]))
+                start = results[2*n:]
+                amplitudes = originalAmplitudes if amplitude is None else dict.fromkeys(axes, amplitude)
+                speeds = {axis: {} for axis in axes}
+                try:
+                    self._moveState = True
+                    for frequency in frequencies:
+                        calls = []
+                        for axis in axes:
+                            calls.append(('setAmplitude', [axis, amplitudes[axis]]))
+                            calls.append(('setFrequency', [axis, frequency]))
+                        self.device.batch(calls)
+                        samples = {axis: [] for axis in axes}
+                        for continuous, eot in (('setContinuousFwd', 'getStatusEotFwd'),
+                                                ('setContinuousBkwd', 'getStatusEotBkwd')):
+                            begin = self.device.batch([('getPosition', [axis]) for axis in axes])
+                            t0 = time.time()
+                            self.device.batch([(continuous, [axis, True]) for axis in axes])
+                            time.sleep(duration)
+                            self.device.batch([(continuous, [axis, False]) for axis in axes])
+                            t1 = time.time()
+                            results = self.device.batch([('getPosition', [axis]) for axis in axes] +
+                                                        [(eot, [axis]) for axis in axes])
+                            for axis, p0, p1, pinned in zip(axes, begin, results[:n], results[n:]):
+                                # 到达行程末端时速度偏小，不计入
+                                if not pinned:
+                                    samples[axis].append(abs(p1 - p0) / (t1 - t0))
+                        for axis in axes:
+                            if samples[axis]:
+                                speeds[axis][frequency] = sum(samples[axis]) / len(samples[axis])
+                finally:
+                    calls = []
+                    for axis in axes:
+                        calls.append(('setContinuousFwd', [axis, False]))
+                        calls.append(('setContinuousBkwd', [axis, False]))
+                        calls.append(('setAmplitude', [axis, originalAmplitudes[axis]]))
+                        calls.append(('setFrequency', [axis, originalFrequencies[axis]]))
+                    self.device.batch(calls)
                     self._moveState = False
+                    # 不同频率下的速度不同，正反两次移动不能抵消，需要返回原来的位置
+                    self._move(list(axes), list(start), 60, 1, None)
+                self._speeds.update(speeds)
+                for axis in axes:
+                    print('speed for axis {} is: {}'.format(str(axis), str(speeds[axis])))
+                    if apply:
+                        if not speeds[axis]:
+                            print('Warning: axis {} is at the end of travel, profile is not set'.format(str(axis)))
+                            continue
+                        tuned = [f for f in frequencies if f in speeds[axis]]
+                        fastest = max(tuned, key=speeds[axis].get)
+                        window = speeds[axis][fastest] * reaction
+                        fine = min([f for f in tuned if speeds[axis][f] * finetime >= window] or [fastest])
+                        self.setProfile((amplitudes[axis], fastest), (amplitudes[axis], fine), window, axes=[axis])
+                return speeds
+
+        def _setAxisRange(self, axis, _range):
+            t_range = list(self._info['range'])
+            t_range[axis] = tuple(_range)
+            self._info['range'] = tuple(t_range)
+
+        def discoverRange(self, axes=None, timeout=60, eottimeout=1, save=True):
+            """
+            所有轴同时连续移动到正向与反向的行程末端，测量行程，结束后返回原来的位置
+            :param axes: 需要测量的轴，默认为None即所有轴
+            :param timeout: 每个方向的超时时间，单位s
+            :param eottimeout: 位置在此时间内没有变化时认为到达行程末端，单位s
+            :param save: 是否保存到rangeFile
+            :return: 行程
+            """
+            with self._lock:
+                if not self.device:
+                    return
+                if axes is None:
+                    axes = range(self._info['numaxes'])
+                start = self.getPosition()
+                try:
+                    self._moveState = True
+                    upper = amctools.findEot(self.device, axes, True, timeout, eottimeout)
+                    lower = amctools.findEot(self.device, axes, False, timeout, eottimeout)
+                except SystemError:
+                    self._moveState = None
+                    self.close()
+                    raise
+                except:
+                    # 停止连续移动
+                    self._stopAxes(axes)
                     raise
+                finally:
+                    if self._moveState:
+                        self._moveState = False
+                for axis in axes:
+                    self._setAxisRange(axis, (lower[axis], upper[axis]))
+                print('range for each axis is: {}'.format(str(self._info['range'])))
+                if save:
+                    self.saveRange()
+                self.move(start)
+                return self.getRange()
+
+        def loadRange(self):
+            """
+            :return: rangeFile中此设备的行程，没有时返回None
+            """
+            serial = self._device_info.get('serial')
+            if not serial:
+                return
+            with AMCPZTController._rangeFileLock:
+                return self._readRangeFile().get(serial)
+
+        # 文件不存在或者损坏时返回空字典，调用时需要持有_rangeFileLock
+        def _readRangeFile(self):
+            if not os.path.isfile(self.rangeFile):
+                return {}
+            try:
+                with open(self.rangeFile, encoding='utf-8') as fp:
+                    data = json.load(fp)
+            except (ValueError, OSError) as e:
+                print('Warning: ignore corrupt range file {}: {}'.format(self.rangeFile, str(e)))
+                return {}
+            if not isinstance(data, dict):
+                print('Warning: ignore corrupt range file {}'.format(self.rangeFile))
+                return {}
+            return data
+
+        def saveRange(self):
+            serial = self._device_info.get('serial')
+            if not serial:
+                return
+            with AMCPZTController._rangeFileLock:
+                data = self._readRangeFile()
+                data[serial] = [list(_range) for _range in self._info['range']]
+                directory = os.path.dirname(self.rangeFile)
+                if directory:
+                    os.makedirs(directory, exist_ok=True)
+                with open(self.rangeFile, 'w', encoding='utf-8') as fp:
+                    json.dump(data, fp, ensure_ascii=False, indent=2)
+
+        # 不需要锁，移动过程中也可以立即停止
+        def _stopAxes(self, axes):
+            device = self.device
+            if not device:
+                return
+            calls = []
+            for i in axes:
+                calls.append(('setMove', [i, False]))
+                calls.append(('setContinuousFwd', [i, False]))
+                calls.append(('setContinuousBkwd', [i, False]))
+            device.batch(calls)
+
+        def halt(self):
+            # 紧急停止，所有轴的驱动与连续移动以一次批处理请求停止
+            if not self.device:
+                return
+            self._haltCount += 1
+            self._stopAxes(range(self._info['numaxes']))
 
         def close(self):
+            self.stopSampler()
+            self.stopArbiter()
             with self._lock:
                 if not self.device:
                     return
                 try:
+                    self.disarmRealTimeIn()
+                    calls = []
                     for i in range(self._info['numaxes']):
-                        AMC.setMove(self.device, i, False)
-                        AMC.setOutput(self.device, i, False)
-                    AMC.close(self.device)
+                        calls.append(('setMove', [i, False]))
+                        calls.append(('setOutput', [i, False]))
+                    self.device.batch(calls)
+                    self.device.close()
                 except Exception as e:
                     print(str(e))
                 finally:
                     self.device = None
                     self._device_info.clear()
+                    self._rtin.clear()
 
         def __del__(self):
             print('关闭AMC压电:{}'.format(self.name))
             self.close()
 
+
+    class AsyncAMCPZTController(object):
+        """
+        基于asyncio的AMC版本PZT控制器，与设备通信的方法都是协程，
+        多个控制器以及多个轴可以在同一个事件循环中并发驱动，不需要为每个控制器创建线程。
+
+        proprety:
+            device-目标设备对象，AMC.AsyncAMCClient
+            _info-字典类型，保存设备对象主要信息
+            name-目标设备对象的本地名称
+            _moveState-移动状态
+            _lock-asyncio锁，保证同一时刻只有一个移动
+
+        method:
+            __init__-初始化
+            connect-连接AMC设备
+            _init_d-初始化，获得物理设备的具体参数
+            isOpen-判断设备是否打开
+            isMoving-判断是否在移动
+            getStartPosition-返回目标设备的初始位置
+            getRange-返回PZT的行程
+            getPosition-获得当前的位置
+            waitontarget-等待单个轴到达目标位置
+            move-以绝对坐标的形式移动到目标位置
+            moveRel-以相对坐标的形式移动
+            close-关闭物理设备
+        """
+
+        def __init__(self, name, *args, **kwargs):
+            self.name = name
+            self.device = None
+            self._info = {'numaxes': None,
+                          'startPosition': None,
+                          'range': [],
+                          'position': None}
+            self._moveState = None
+            self._lock = None
+
+        async def connect(self, ip='192.168.1.1', *args, port=AMC.TCP_PORT, **kwargs):
+            if self.device:
+                return
+            self._lock = asyncio.Lock()
+            self.device = await AMC.AsyncAMCClient.open(ip, port=port)
+            await self._init_d()
+
+        async def _init_d(self):
+            # AMC can only control axis [0..2]
+            results = await self.device.batch([('setOutput', [i, True]) for i in range(3)], check=False)
+            numaxes = 0
+            for result in results:
+                if result[0] != 0:
+                    break
+                numaxes += 1
+            calls = []
+            for i in range(numaxes):
+                calls.append(('setMove', [i, False]))
+                calls.append(('setEotOutputDeactive', [i, True]))
+            await self.device.batch(calls)
+            self._info['numaxes'] = numaxes
+            self._info['range'] = [(None, None)] * numaxes
+            self._info['startPosition'] = await self.getPosition()
+            print('start pos is: {}'.format(str(self._info['startPosition'])))
+            self._moveState = False
+
+        def isOpen(self):
+            return bool(self.device)
+
+        def isMoving(self):
+            return self._moveState
+
+        def getStartPosition(self):
+            return copy.deepcopy(self._info['startPosition'])
+
+        def getRange(self):
+            return copy.deepcopy(self._info['range'])
+
+        async def getPosition(self):
+            if not self.device:
+                return
+            pos = await self.device.batch([('getPosition', [i]) for i in range(self._info['numaxes'])])
+            self._info['position'] = pos
+            return tuple(pos)
+
+        async def waitontarget(self, axis, timeout=60, eottimeout=1):
+            """
+            等待单个轴到达目标位置，与amctools.waitontarget相同，但等待时不阻塞事件循环
+            :return: 到达目标位置返回True，检测到行程末端返回False
+            """
+            device = self.device
+            maxtime = time.time() + timeout
+            target_range, target_pos, last_pos = await device.batch([('getTargetRange', [axis]),
+                                                                     ('getTargetPosition', [axis]),
+                                                                     ('getPosition', [axis])])
+
+            # eot detection
+            max_interval = int(eottimeout/0.1) + 1
+            i_interval = 0
+
+            while True:
+                try:
+                    status, pos = await device.batch([('getStatusMoving', [axis]), ('getPosition', [axis])])
+                except AMC.AMCError:
+                    raise SystemError('System error! Please reconnect the device.')
+
+                if status != 1: # status == 1 for moving status
+                    return True
+
+                if abs(pos - target_pos) < target_range:
+                    await device.setMove(axis, False)
+                    return True
+
+                # no-blocking End of Travel detection
+                if i_interval != max_interval:
+                    i_interval += 1
+                else:
+                    i_interval = 0
+                    if abs(last_pos - pos) < target_range:
+                        await device.setMove(axis, False)
+                        return False
+                    last_pos = pos
+
+                if time.time() > maxtime:
+                    raise SystemError('waitontarget() timed out after %.1f seconds' % timeout)
+                await asyncio.sleep(0.1)
+
+        async def move(self, targets, timeout=60, eottimeout=1):
+            if not self.device:
+                raise SystemError('No available device.')
+            async with self._lock:
+                if len(targets) != self._info['numaxes']:
+                    raise TypeError('The number of axes set is not equal to the' 
+                                    'number of axes of the device.')
+                try:
+                    self._moveState = True
+                    if not self.device:
+                        raise SystemError('No available device.')
+
+                    # out of range judgement
+                    targets = [int(t) for t in targets]
+                    for i, _range in enumerate(self._info['range']):
+                        if (None not in _range) and ((targets[i] > _range[1]) or (targets[i] < _range[0])):
+                            raise OutOfRange('Sorry, out of range in axis {}'.format(str(i)))
+
+                    #　move to targets
+                    print('{} targets: {}'.format(str(self.name), str(targets)))
+                    calls = []
+                    for i, target in enumerate(targets):
+                        calls.append(('setTargetPosition', [i, target]))
+                        calls.append(('setMove', [i, True]))
+                    await self.device.batch(calls)
+
+                    # 所有轴同时等待
+                    states = await asyncio.gather(*[self.waitontarget(i, timeout, eottimeout)
+                                                    for i in range(self._info['numaxes'])])
+                    self._moveState = False
+
+                    # update range!
+                    if not all(states):
+                        pos = await self.getPosition()
+                        err_info = ""
+                        for i, state in enumerate(states):
+                            if not state:
+                                _range = list(self._info['range'][i])
+                                if pos[i] < targets[i]:
+                                    _range[1] = pos[i]
+                                else:
+                                    _range[0] = pos[i]
+                                self._info['range'][i] = tuple(_range)
+                                print('range for axis {} is: {}'.format(str(i), str(_range)))
+                                err_info += 'Sorry, out of range in axis {}. ' \
+                                        'Position {} Range {}\n'.format(str(i), str(pos[i]), str(_range))
+                        raise OutOfRange(err_info)
+
+                except SystemError:
+                    self._moveState = None
+                    await self.close()
+                    raise
+                except:
+                    if self.device:
+                        await self.device.batch([('setMove', [i, False]) for i in range(self._info['numaxes'])])
+                    self._moveState = False
+                    raise
+
+        async def moveRel(self, reltargets, **kwargs):
+            if not self.device:
+                raise SystemError('No available device.')
+            pos = await self.getPosition()
+            await self.move([p + reltarget for p, reltarget in zip(pos, reltargets)], **kwargs)
+
+        async def close(self):
+            if not self.device:
+                return
+            try:
+                calls = []
+                for i in range(self._info['numaxes']):
+                    calls.append(('setMove', [i, False]))
+                    calls.append(('setOutput', [i, False]))
+                await self.device.batch(calls)
+                await self.device.close()
+            except Exception as e:
+                print(str(e))
+            finally:
+                self.device = None
+
 except ImportError:
     print('Warning: No module name AMC')
     AMCPZTController = None
+    AsyncAMCPZTController = None
+
+
+class _SubMoveHandle(object):
+    """
+    组合控制器中粗调或精调移动的句柄，代替MoveHandle传入子控制器的等待函数。
+    每次轮询时以{轴序号: 位置}调用report，由report换算为组合位置报告给外部的MoveHandle，
+    外部句柄被取消时report抛出MoveCancelled。修改目标位置由组合控制器处理，不传入子控制器。
+    """
+
+    def __init__(self, report, axes):
+        self._report = report
+        self._axes = list(axes)
+
+    def _progress(self, position):
+        self._report(dict(zip(self._axes, position)))
+
+
+class CompositePZTController(PZTController):
+    """
+    粗调与精调组合的PZT控制器，例如AMC(粗调，大行程)与PI(精调，纳米级)。
+    组合位置 = 粗调位置 + (精调位置 - 精调中心)*scale。目标在精调的行程内时只移动精调，粗调保持不动；
+    否则粗调移动与精调回中同时进行，最后由精调消除粗调的误差。
+
+    proprety:
+        device-(coarse, fine)，两个已经连接的PZTController对象，关闭时不会关闭它们
+        name-目标设备对象的本地名称
+        _axes-轴的对应关系，(粗调轴, 精调轴)的列表
+        _scale-精调位置的单位换算为粗调位置的单位的比例，例如PI为um，AMC为nm时为1000
+        _margin-精调行程两端保留的比例，只移动精调时目标不能进入此范围
+        _centers-各轴精调的中心位置
+        _fineLimits-各轴只移动精调时精调的允许范围
+        _executor-线程池，同时操作粗调与精调
+
+    method:
+        __init__-初始化
+        connect-组合两个已经连接的控制器
+        getPosition-获得组合位置
+        move-以绝对坐标的形式移动到目标位置
+        halt-停止粗调与精调
+        close-解除组合
+    """
+
+    def __init__(self, name, *args, **kwargs):
+        super(CompositePZTController, self).__init__()
+        self.name = name
+        self._axes = []
+        self._scale = 1.0
+        self._margin = 0.1
+        self._centers = []
+        self._fineLimits = []
+        self._executor = None
+
+    def connect(self, coarse, fine, axes=None, scale=1000.0, margin=0.1, **kwargs):
+        """
+        :param coarse: 粗调PZTController对象
+        :param fine: 精调PZTController对象
+        :param axes: (粗调轴, 精调轴)的列表，默认为None即按序号一一对应
+        :param scale: 精调位置的单位换算为粗调位置的单位的比例
+        :param margin: 精调行程两端保留的比例
+        """
+        with self._lock:
+            if self.device:
+                return
+            if not (coarse.isOpen() and fine.isOpen()):
+                raise SystemError('Both coarse and fine controllers must be connected.')
+            if axes is None:
+                axes = [(i, i) for i in range(min(coarse.getInit()['numaxes'], fine.getInit()['numaxes']))]
+            self._axes = [tuple(axis) for axis in axes]
+            self._scale = scale
+            self._margin = margin
+            self._device_info.update(coarse=coarse.name, fine=fine.name, axes=self._axes, scale=scale)
+            self.device = (coarse, fine)
+            self._executor = ThreadPoolExecutor(max_workers=2)
+            self._init_d()
+
+    def _init_d(self):
+        with self._lock:
+            self.setNumaxes_d()
+            self.setRange_d()
+            self.setStartPosition()
+            self._moveState = False
+
+    def setNumaxes_d(self):
+        with self._lock:
+            if not self.device:
+                return
+            self._info['numaxes'] = len(self._axes)
+
+    def setRange_d(self):
+        with self._lock:
+            if not self.device:
+                return
+            coarse, fine = self.device
+            crange = coarse.getRange()
+            frange = fine.getRange()
+            self._centers = []
+            self._fineLimits = []
+            t_range = []
+            for c, f in self._axes:
+                fmin, fmax = frange[f]
+                if fmin is None or fmax is None:
+                    raise TypeError('The range of fine axis {} is unknown.'.format(str(f)))
+                center = (fmin + fmax) / 2
+                span = fmax - fmin
+                self._centers.append(center)
+                self._fineLimits.append((fmin + self._margin * span, fmax - self._margin * span))
+                cmin, cmax = crange[c]
+                # 总行程
+                t_range.append((None if cmin is None else cmin + (fmin - center) * self._scale,
+                                None if cmax is None else cmax + (fmax - center) * self._scale))
+            self._info['range'] = tuple(t_range)
+
+    def startup(self):
+        with self._lock:
+            if not self.device:
+                return
+            coarse, fine = self.device
+            self._parallel((coarse.startup,), (fine.startup,))
+            self.setRange_d()
+
+    def _parallel(self, *calls):
+        # 同时运行，全部结束后抛出第一个异常
+        futures = [self._executor.submit(*call) for call in calls]
+        errors = [future.exception() for future in futures]
+        for error in errors:
+            if error is not None:
+                raise error
+        return [future.result() for future in futures]
+
+    def _positions(self):
+        coarse, fine = self.device
+        future = self._executor.submit(coarse.getPosition)
+        fpos = fine.getPosition()
+        return future.result(), fpos
+
+    def _combine(self, cpos, fpos):
+        return [cpos[c] + (fpos[f] - self._centers[k]) * self._scale for k, (c, f) in enumerate(self._axes)]
+
+    def getPosition(self):
+        if not self.device:
+            return
+        cpos, fpos = self._positions()
+        pos = self._combine(cpos, fpos)
+        self._info['position'] = pos
+        return tuple(pos)
+
+    @staticmethod
+    def _moveSub(controller, positions, targets, timeout, report=None):
+        # 只有一个轴需要移动时只移动这个轴
+        if not targets:
+            return
+        if len(targets) == 1:
+            (axis, target), = targets.items()
+            handle = None if report is None else _SubMoveHandle(report, [axis])
+            controller.moveAxis(axis, target, timeout=timeout, handle=handle)
+        else:
+            vector = list(positions)
+            for axis, target in targets.items():
+                vector[axis] = target
+            handle = None if report is None else _SubMoveHandle(report, range(len(vector)))
+            controller.move(vector, timeout=timeout, handle=handle)
+
+    def _fineTargets(self, targets, cpos, fpos):
+        combined = self._combine(cpos, fpos)
+        return {f: fpos[f] + (targets[k] - combined[k]) / self._scale for k, (c, f) in enumerate(self._axes)}
+
+    def move(self, targets, timeout=60, handle=None):
+        """
+        :param handle: MoveHandle对象，粗调与精调轮询时报告组合位置，被取消时停止两者，
+                       修改的目标位置在当前的移动结束后执行
+        """
+        with self._lock:
+            targets = self._checkTargets(targets)
+            try:
+                self._moveState = True
+                if not self.device:
+                    raise SystemError('No available device.')
+                halts = self._haltCount
+                while True:
+                    self._moveOnce(targets, timeout, handle, halts)
+                    newtargets = None if handle is None else handle._takeRetarget()
+                    if newtargets is None:
+                        break
+                    targets = self._checkTargets(newtargets)
+                    handle.targets = tuple(targets)
+                self._moveState = False
+            except:
+                self._moveState = False
+                raise
+
+    def _moveOnce(self, targets, timeout, handle, halts):
+        coarse, fine = self.device
+        print('{} targets: {}'.format(str(self.name), str(targets)))
+        cpos, fpos = self._positions()
+        current = {'coarse': list(cpos), 'fine': list(fpos)}
+
+        # 子控制器轮询时更新对应的位置，换算为组合位置报告给handle
+        def reporter(stage):
+            if handle is None:
+                return None
+
+            def report(positions):
+                for axis, pos in positions.items():
+                    current[stage][axis] = pos
+                handle._report(tuple(self._combine(current['coarse'], current['fine'])))
+            return report
+
+        ftargets = self._fineTargets(targets, cpos, fpos)
+        # 精调无法到达的轴，粗调直接移动到目标位置，同时精调回中
+        ctargets = {}
+        centers = {}
+        for k, (c, f) in enumerate(self._axes):
+            lo, hi = self._fineLimits[k]
+            if not lo <= ftargets[f] <= hi:
+                ctargets[c] = targets[k]
+                centers[f] = self._centers[k]
+        # 开始移动前检查所有子移动的目标，避免其中一个已经开始移动后另一个超出范围
+        ctargets = {c: coarse._checkAxisTarget(c, t) for c, t in ctargets.items()}
+        centers = {f: fine._checkAxisTarget(f, t) for f, t in centers.items()}
+        if ctargets:
+            self._parallel((self._moveSub, coarse, cpos, ctargets, timeout, reporter('coarse')),
+                           (self._moveSub, fine, fpos, centers, timeout, reporter('fine')))
+            self._checkHalted(halts, targets)
+            # 精调消除粗调的误差
+            cpos, fpos = self._positions()
+            current = {'coarse': list(cpos), 'fine': list(fpos)}
+            ftargets = self._fineTargets(targets, cpos, fpos)
+            frange = fine.getRange()
+            for f in ftargets:
+                ftargets[f] = min(max(ftargets[f], frange[f][0]), frange[f][1])
+        ftargets = {f: fine._checkAxisTarget(f, t) for f, t in ftargets.items()}
+        self._moveSub(fine, fpos, ftargets, timeout, reporter('fine'))
+        self._checkHalted(halts, targets)
+
+    def halt(self):
+        if not self.device:
+            return
+        coarse, fine = self.device
+        self._haltCount += 1
+        # 粗调与精调同时停止。不使用_executor，移动时其中的线程被子移动占用
+        errors = []
+
+        def haltCoarse():
+            try:
+                coarse.halt()
+            except Exception as e:
+                errors.append(e)
+
+        thread = threading.Thread(target=haltCoarse)
+        thread.daemon = True
+        thread.start()
+        try:
+            fine.halt()
+        finally:
+            thread.join()
+        if errors:
+            raise errors[0]
+
+    def close(self):
+        self.stopSampler()
+        self.stopArbiter()
+        with self._lock:
+            if not self.device:
+                return
+            try:
+                self._executor.shutdown()
+            except Exception as e:
+                print(str(e))
+            finally:
+                self.device = None
+                self._executor = None
+                self._device_info.clear()
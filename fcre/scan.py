@@ -0,0 +1,196 @@
+# -*- coding: utf-8 -*-
+
+__all__ = ['scanOrder', 'Scan']
+
+import threading
+import queue
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+
+def _serpentine(shape):
+    if len(shape) == 1:
+        return [(i,) for i in range(shape[0])]
+    inner = _serpentine(shape[1:])
+    order = []
+    for i in range(shape[0]):
+        # 奇数行反向，相邻两点之间只有一个轴移动一步
+        seq = inner if i % 2 == 0 else inner[::-1]
+        order += [(i,) + index for index in seq]
+    return order
+
+
+def _spiral(shape):
+    if len(shape) != 2:
+        raise ValueError('spiral scan only supports two axes')
+    rows, cols = shape
+    i, j = (rows - 1) // 2, (cols - 1) // 2
+    order = [(i, j)]
+    di, dj = 0, 1
+    step = 1
+    while len(order) < rows * cols:
+        for _ in range(2):
+            for _ in range(step):
+                i, j = i + di, j + dj
+                if 0 <= i < rows and 0 <= j < cols:
+                    order.append((i, j))
+            di, dj = dj, -di
+        step += 1
+    return order
+
+
+def scanOrder(shape, pattern='raster'):
+    """
+    获得扫描的顺序
+    :param shape: 每个扫描轴的点数
+    :param pattern: 'raster'-逐行扫描，'serpentine'-蛇形扫描，'spiral'-从中心向外的螺旋扫描(只支持两个轴)
+    :return: 下标的列表，按照扫描的顺序排列
+    """
+    shape = tuple(shape)
+    if pattern == 'raster':
+        return list(np.ndindex(*shape))
+    elif pattern == 'serpentine':
+        return _serpentine(shape)
+    elif pattern == 'spiral':
+        return _spiral(shape)
+    else:
+        raise ValueError('Unknown scan pattern: {}'.format(pattern))
+
+
+class Scan(object):
+    """
+    在PZTController的若干轴上扫描，每个点从相机获得图像并计算评价值，保存在预先分配的numpy数组中。
+    移动与拍摄在调用线程中进行，图像处理在子线程中进行，处理上一个点的图像时已经开始移动到下一个点。
+
+    proprety:
+        controller-PZTController对象
+        axes-扫描的轴的序号
+        points-每个扫描轴的位置序列
+        shape-每个扫描轴的点数
+        cameras-包含Camera对象的序列
+        pretreatment-Pretreatment对象，默认为None即不进行预处理
+        evaluation-Evaluation对象，默认为None
+        metric-由图像(或evaluation的结果)计算评价值的函数
+        pattern-扫描方式，参考scanOrder
+        depth-等待处理的点的最大个数
+        grid-评价值数组，形状为shape加上评价值的形状，未扫描的点为nan
+        positions-每个点的目标位置，形状为shape加上扫描轴的个数
+        _movekwargs-move的其他参数
+        _stopEvent-停止事件
+        _error-处理线程中产生的异常
+
+    method:
+        __init__-初始化
+        run-运行扫描，返回grid
+        stop-停止扫描
+        process-计算单个点的评价值，可以在子类中覆盖
+    """
+
+    def __init__(self, controller, axes, points, cameras, pretreatment=None, evaluation=None,
+                 metric=None, pattern='raster', depth=4, **movekwargs):
+        if len(axes) != len(points):
+            raise TypeError('The number of axes is not equal to the number of point sequences.')
+        self.controller = controller
+        self.axes = tuple(axes)
+        self.points = [np.asarray(p, dtype=float) for p in points]
+        self.shape = tuple(len(p) for p in self.points)
+        self.cameras = tuple(cameras)
+        self.pretreatment = pretreatment
+        self.evaluation = evaluation
+        self.metric = metric
+        self.pattern = pattern
+        self.depth = depth
+        self.grid = None
+        self.positions = None
+        self._movekwargs = movekwargs
+        self._stopEvent = threading.Event()
+        self._error = None
+
+    def process(self, imgs):
+        """
+        计算单个点的评价值
+        :param imgs: 所有相机拍摄的图像
+        :return: 评价值，数值或者数组
+        """
+        if self.pretreatment is not None:
+            imgs = self.pretreatment.process(imgs)
+        if self.evaluation is not None:
+            result = self.evaluation.compute(imgs)
+            if self.metric is not None:
+                return self.metric(result)
+            # 默认为所有相机的质心偏移
+            return np.concatenate([np.ravel(d) for d in result])
+        if self.metric is not None:
+            return self.metric(imgs)
+        # 默认为每个相机图像的平均亮度
+        return np.array([np.mean(img) for img in imgs])
+
+    def stop(self):
+        self._stopEvent.set()
+
+    def run(self):
+        """
+        :return: 评价值数组grid
+        """
+        self._stopEvent.clear()
+        self._error = None
+        self.grid = None
+        self.positions = np.full(self.shape + (len(self.axes),), np.nan)
+
+        pending = queue.Queue(maxsize=self.depth)
+        worker = threading.Thread(target=self._processLoop, args=(pending,))
+        worker.daemon = True
+        worker.start()
+        # 多个相机同时拍摄
+        executor = ThreadPoolExecutor(max_workers=len(self.cameras)) if len(self.cameras) > 1 else None
+        try:
+            targets = list(self.controller.getPosition())
+            last = None
+            for index in scanOrder(self.shape, self.pattern):
+                if self._stopEvent.is_set() or self._error is not None:
+                    break
+                position = [self.points[k][i] for k, i in enumerate(index)]
+                self._moveTo(targets, position, last)
+                last = position
+                if executor is None:
+                    imgs = [cm.read() for cm in self.cameras]
+                else:
+                    imgs = list(executor.map(lambda cm: cm.read(), self.cameras))
+                self.positions[index] = position
+                pending.put((index, imgs))
+        finally:
+            pending.put(None)
+            worker.join()
+            if executor is not None:
+                executor.shutdown()
+        if self._error is not None:
+            raise self._error
+        return self.grid
+
+    def _moveTo(self, targets, position, last):
+        changed = [k for k in range(len(self.axes)) if last is None or position[k] != last[k]]
+        for k in changed:
+            targets[self.axes[k]] = position[k]
+        # 只有一个轴改变时只移动这个轴
+        if len(changed) == 1:
+            k = changed[0]
+            self.controller.moveAxis(self.axes[k], position[k], **self._movekwargs)
+        elif changed:
+            self.controller.move(targets, **self._movekwargs)
+
+    def _processLoop(self, pending):
+        while True:
+            item = pending.get()
+            if item is None:
+                return
+            if self._error is not None:
+                continue
+            index, imgs = item
+            try:
+                value = np.asarray(self.process(imgs), dtype=float)
+                if self.grid is None:
+                    self.grid = np.full(self.shape + value.shape, np.nan)
+                self.grid[index] = value
+            except Exception as e:
+                self._error = e
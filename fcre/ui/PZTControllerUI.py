@@ -21,6 +21,7 @@ class PZTControllerUI(QtWidgets.QWidget):
         devpool-设备代理池
         _info-设备的信息
         _cache-缓存列表，保存当前位置
+        _jogHandle-最近一次检查过的moveLatest移动的MoveHandle，避免重复报告
 
         _updateThread-循环的线程对象，更新PZT位置
         _moveThread-单次运行的线程对象，移动到目标位置
@@ -58,6 +59,7 @@ class PZTControllerUI(QtWidgets.QWidget):
             self._info['startPosition'] = self._info['numaxes'] * [0]
         self._cache = self._info['numaxes'] * [0]  # 列表，存储位置的缓存信息
         self._lastMove = self._info['numaxes'] * [0]
+        self._jogHandle = None
 
         # 配置线程对象
         self._updateThread = NonstopDo(self._updateFun, intervalms=100)  # 更新间隔100ms,即10Hz
@@ -150,6 +152,10 @@ class PZTControllerUI(QtWidgets.QWidget):
         self.moveButton.setEnabled(False)
         self.moveButton.clicked.connect(lambda: self.customMove())
         buttonsly.addWidget(self.moveButton)
+        self.jogCheckBox = QtWidgets.QCheckBox('jog')
+        self.jogCheckBox.setEnabled(False)
+        self.jogCheckBox.setToolTip('move as soon as the value changes, only the latest target is executed')
+        buttonsly.addWidget(self.jogCheckBox)
         customLayout.addWidget(buttons)
 
         self.axesSpinBox = []
@@ -198,16 +204,26 @@ class PZTControllerUI(QtWidgets.QWidget):
         self.startupButton.setEnabled(flag)
         self.moveButton.setEnabled(flag)
         self.restoreButton.setEnabled(flag)
+        self.jogCheckBox.setEnabled(flag)
         for i in range(self._info['numaxes']):
             self.singleMoveButton[i].setEnabled(flag)
 
     def posChanged(self, pos, n):
         self._cache[n] = pos
+        if self.jogCheckBox.isChecked():
+            self._lastMove[n] = pos
+            # moveLatest立即返回，移动过程中改变的值直接修改目标位置
+            try:
+                self.devpool.doSafely(self.type, self.name, 'moveLatest', tuple(self._lastMove[:(self._info['numaxes'])]))
+            except OutOfRange:
+                self._outRangeSignal.emit()
+            except Exception as e:
+                self._errorSignal.emit(str(e))
 
     def _singleMoveFun(self, n):
         try:
             self._lastMove[n] = self._cache[n]
-            self.devpool.doSafely(self.type, self.name, 'move', tuple(self._lastMove[:(self._info['numaxes'])]))
+            self.devpool.doSafely(self.type, self.name, 'moveAxis', n, self._lastMove[n])
         except OutOfRange:
             self._outRangeSignal.emit()
         except SystemError:
@@ -261,6 +277,22 @@ class PZTControllerUI(QtWidgets.QWidget):
         self.updateInfo()
         self.positionInfoLine.setText(str(self._info['position']))
         self.deviationInfoLine.setText(str(self._info['deviation']))
+        self._checkJog()
+
+    # moveLatest立即返回，移动在仲裁器的线程中失败时只能从MoveHandle获得结果
+    def _checkJog(self):
+        handle = self.devpool.do(self.type, self.name, 'getLatestHandle')
+        if handle is None or handle is self._jogHandle:
+            return
+        self._jogHandle = handle
+        state = handle.state()
+        if state == 'outofrange':
+            self._outRangeSignal.emit()
+        elif state == 'error':
+            if isinstance(handle.exception(), SystemError):
+                self._systemErrorSignal.emit()
+            else:
+                self._errorSignal.emit(str(handle.exception()))
 
     def customRestore(self):
         self.setButtonEnabled(False)